@@ -0,0 +1,89 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Measure the overhead of evaluation budgets (:meth:`.Context.setBudget`)
+on a render repeating over a list of items.  Run from a checkout
+with::
+
+    python -m benchmarks.budget [--renders N] [--items N] [--repeat N]
+"""
+import argparse
+import sys
+import time
+
+from zope.tales.engine import DefaultEngine
+
+
+EXPRESSIONS = [
+    'item/title',
+    'string:${item/url}/view',
+    'python: item["count"] + 1',
+    'repeat/item/odd',
+]
+
+
+def render(engine, items, budget):
+    context = engine.getContext(items=items)
+    if budget is not None:
+        context.setBudget(**budget)
+    context.beginScope()
+    it = context.setRepeat('item', 'items')
+    while next(it):
+        for expression in EXPRESSIONS:
+            context.evaluate(expression)
+    context.endScope()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.budget',
+        description='Measure the overhead of evaluation budgets.')
+    parser.add_argument('--renders', type=int, default=500,
+                        help='the number of renders timed')
+    parser.add_argument('--items', type=int, default=50,
+                        help='the number of items repeated over')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='the number of measurements kept the best of')
+    args = parser.parse_args(argv)
+
+    engine = DefaultEngine()
+    engine.compileCacheSize = None
+    engine.warmup(EXPRESSIONS + ['items'])
+    items = [{'title': 'Item %d' % i, 'url': '/item/%d' % i, 'count': i}
+             for i in range(args.items)]
+    modes = [('none', None),
+             ('steps', {'steps': 10 ** 9}),
+             ('seconds', {'seconds': 3600}),
+             ('both', {'seconds': 3600, 'steps': 10 ** 9})]
+    best = dict.fromkeys([name for name, budget in modes], float('inf'))
+    # Interleave the modes and keep the best time of each, to reduce
+    # the noise of the machine.
+    for i in range(args.repeat):
+        for name, budget in modes:
+            render(engine, items, budget)
+            start = time.perf_counter()
+            for j in range(args.renders):
+                render(engine, items, budget)
+            seconds = (time.perf_counter() - start) / args.renders
+            best[name] = min(best[name], seconds)
+    print('%-10s %12s %10s' % ('budget', 'us/render', 'overhead'))
+    base = best['none']
+    for name, budget in modes:
+        print('%-10s %12.1f %9.1f%%' % (
+            name, best[name] * 1e6, (best[name] / base - 1) * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
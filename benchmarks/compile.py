@@ -0,0 +1,95 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Measure the throughput of :meth:`.ExpressionEngine.compile` when
+several threads compile the same expressions with a shared engine, as
+when the templates of a freshly started server are rendered at once.
+
+Each thread compiles the whole corpus in its own order, first with an
+empty cache (concurrent compilations of an expression are deduplicated)
+and then again with the cache filled.  Run from a checkout with::
+
+    python -m benchmarks.compile [--threads 1 2 4 8 16] [--size N]
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+from zope.tales.engine import DefaultEngine
+
+
+def corpus(size):
+    expressions = []
+    for i in range(size):
+        expressions.extend([
+            'item/title%d | nothing' % i,
+            'string:${item/url}/view%d' % i,
+            'python: item.get("count%d", 0) + 1' % i,
+            'not: exists:item/hidden%d' % i,
+        ])
+    return expressions
+
+
+def run(engine, threads, expressions):
+    orders = []
+    for i in range(threads):
+        order = list(expressions)
+        random.Random(i).shuffle(order)
+        orders.append(order)
+    barrier = threading.Barrier(threads + 1)
+
+    def compile_all(order):
+        barrier.wait()
+        for expression in order:
+            engine.compile(expression)
+
+    workers = [threading.Thread(target=compile_all, args=(order,))
+               for order in orders]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.compile',
+        description='Measure concurrent compilation throughput.')
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16],
+                        help='the numbers of threads to measure')
+    parser.add_argument('--size', type=int, default=500,
+                        help='the corpus size (times 4 expressions)')
+    args = parser.parse_args(argv)
+
+    expressions = corpus(args.size)
+    print('%8s %16s %16s' % ('threads', 'cold compiles/s',
+                             'hot compiles/s'))
+    for threads in args.threads:
+        engine = DefaultEngine()
+        engine.compileCacheSize = None
+        total = threads * len(expressions)
+        cold = run(engine, threads, expressions)
+        hot = run(engine, threads, expressions)
+        print('%8d %16.0f %16.0f' % (threads, total / cold, total / hot))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
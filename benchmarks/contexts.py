@@ -0,0 +1,90 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Compare rendering small fragments with a new context each time and
+with contexts reused from the pool of the engine
+(:meth:`.ExpressionEngine.getPooledContext`).  Run from a checkout
+with::
+
+    python -m benchmarks.contexts [--renders N]
+
+The memory is the peak of the memory allocated during a render, traced
+with :mod:`tracemalloc`.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from zope.tales.engine import DefaultEngine
+
+
+EXPRESSIONS = ['item/title', 'string:${item/url}/view']
+
+
+def fresh(engine, item):
+    context = engine.getContext(item=item)
+    for expression in EXPRESSIONS:
+        context.evaluate(expression)
+
+
+def pooled(engine, item):
+    context = engine.getPooledContext(item=item)
+    for expression in EXPRESSIONS:
+        context.evaluate(expression)
+    engine.releaseContext(context)
+
+
+def allocated(render, engine, item, renders=1000):
+    # The average peak of the memory allocated by a render, in bytes.
+    render(engine, item)
+    total = 0
+    tracemalloc.start()
+    try:
+        for i in range(renders):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            render(engine, item)
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / renders
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.contexts',
+        description='Compare new and pooled contexts.')
+    parser.add_argument('--renders', type=int, default=100000,
+                        help='the number of renders timed')
+    args = parser.parse_args(argv)
+
+    engine = DefaultEngine()
+    engine.compileCacheSize = None
+    engine.warmup(EXPRESSIONS)
+    item = {'title': 'Title', 'url': 'https://example.com/item'}
+    print('%-8s %12s %14s' % ('context', 'us/render', 'bytes/render'))
+    for name, render in (('new', fresh), ('pooled', pooled)):
+        start = time.perf_counter()
+        for i in range(args.renders):
+            render(engine, item)
+        seconds = time.perf_counter() - start
+        print('%-8s %12.2f %14.0f' % (
+            name, seconds / args.renders * 1e6,
+            allocated(render, engine, item)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Compare the ``and:``, ``or:`` and ``if:`` expression types with the
+equivalent ``python:`` expressions.  Run from a checkout with::
+
+    python -m benchmarks.operators [--number N]
+"""
+import argparse
+import sys
+import timeit
+
+from zope.tales.engine import DefaultEngine
+
+
+CASES = [
+    ('and: user, user/admin',
+     'python: user and path("user/admin")'),
+    ('and: nothing, user/admin',
+     'python: nothing and path("user/admin")'),
+    ('or: user/nickname, user/name',
+     'python: path("user/nickname") or path("user/name")'),
+    ('if: user/admin, string:admin, string:user',
+     'python: "admin" if path("user/admin") else "user"'),
+    ('and: exists:user, python: len(items) > 2',
+     'python: exists("user") and len(items) > 2'),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.operators',
+        description='Compare and:, or: and if: with python: forms.')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='the number of evaluations per expression')
+    args = parser.parse_args(argv)
+
+    engine = DefaultEngine()
+    context = engine.getContext(
+        user={'admin': False, 'nickname': '', 'name': 'Jim'},
+        items=[1, 2, 3])
+    print('%-45s %10s %10s %8s' % ('expression', 'native us',
+                                   'python us', 'ratio'))
+    for native, python in CASES:
+        times = []
+        for text in (native, python):
+            expression = engine.compile(text)
+            seconds = timeit.timeit(lambda: expression(context),
+                                    number=args.number)
+            times.append(seconds / args.number * 1e6)
+        print('%-45s %10.2f %10.2f %8.2f' % (native, times[0], times[1],
+                                             times[1] / times[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
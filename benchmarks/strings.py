@@ -0,0 +1,100 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Compare the evaluation of ``string:`` expressions from their segment
+plan with the ``%`` formatting they used before.  Run from a checkout
+with::
+
+    python -m benchmarks.strings [--number N]
+"""
+import argparse
+import sys
+import timeit
+
+from zope.tales.engine import DefaultEngine
+from zope.tales.expressions import _interp
+
+
+CASES = [
+    'string:${base}/${name}',
+    'string:${site/url}/${item/id}/view',
+    'string:${site/url}/folder/${item/id}?page=${page}&size=20',
+    'string:/static/style.css',
+]
+
+
+class PercentStringExpr:
+    # The string: expression before segment plans, for reference.
+
+    def __init__(self, name, expr, engine):
+        if '%' in expr:
+            expr = expr.replace('%', '%%')
+        self._vars = vars = []
+        if '$' in expr:
+            path_type = engine.getTypes()['path']
+            parts = []
+            for exp in expr.split('$$'):
+                if parts:
+                    parts.append('$')
+                m = _interp.search(exp)
+                while m is not None:
+                    parts.append(exp[:m.start()])
+                    parts.append('%s')
+                    vars.append(path_type(
+                        'path', m.group(1) or m.group(2), engine))
+                    exp = exp[m.end():]
+                    m = _interp.search(exp)
+                parts.append(exp)
+            expr = ''.join(parts)
+        self._expr = expr
+
+    def __call__(self, econtext):
+        vvals = []
+        for var in self._vars:
+            v = var(econtext)
+            vvals.append(v)
+        return self._expr % tuple(vvals)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.strings',
+        description='Compare string: segment plans with % formatting.')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='the number of evaluations per expression')
+    args = parser.parse_args(argv)
+
+    engine = DefaultEngine()
+    engine.registerType('percent', PercentStringExpr)
+    context = engine.getContext(
+        base='https://example.com', name='doc-42',
+        site={'url': 'https://example.com'}, item={'id': 'doc-42'},
+        page=3)
+    print('%-58s %8s %8s %7s' % ('expression', 'plan us', '% us',
+                                 'ratio'))
+    for text in CASES:
+        plan = engine.compile(text)
+        percent = engine.compile('percent:' + text[len('string:'):])
+        times = []
+        for expression in (plan, percent):
+            seconds = timeit.timeit(lambda: expression(context),
+                                    number=args.number)
+            times.append(seconds / args.number * 1e6)
+        print('%-58s %8.2f %8.2f %7.2f' % (text, times[0], times[1],
+                                           times[1] / times[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
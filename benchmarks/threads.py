@@ -0,0 +1,99 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Measure how evaluating expressions with one shared engine scales with
+the number of threads.
+
+Each thread renders the same expressions with its own context, as the
+threads of an application server do.  Run from a checkout with::
+
+    python -m benchmarks.threads [--threads 1 2 4 8 16] [--renders N]
+
+On a free-threaded (no-GIL) build the throughput should grow with the
+number of threads up to the number of cores; with the GIL it stays
+flat.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from zope.tales.engine import DefaultEngine
+
+
+EXPRESSIONS = [
+    'item/title',
+    'item/missing | string:none',
+    'string:${item/title} (${item/id})',
+    'python: item["id"] * 2',
+    'not: exists:item/hidden',
+    'and: item/title, item/id',
+]
+
+
+def render(engine, renders, items):
+    context = engine.getContext()
+    for i in range(renders):
+        context.beginScope()
+        context.setLocal('item', items[i % len(items)])
+        for expression in EXPRESSIONS:
+            context.evaluate(expression)
+        context.endScope()
+
+
+def run(engine, threads, renders):
+    items = [{'id': i, 'title': 'Item %d' % i} for i in range(20)]
+    workers = [threading.Thread(target=render,
+                                args=(engine, renders, items))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.threads',
+        description='Measure the scaling of evaluations with threads.')
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16],
+                        help='the numbers of threads to measure')
+    parser.add_argument('--renders', type=int, default=20000,
+                        help='the number of renders per thread')
+    args = parser.parse_args(argv)
+
+    engine = DefaultEngine()
+    engine.compileCacheSize = None
+    engine.warmup(EXPRESSIONS)
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('Python %s, GIL %s' % (sys.version.split()[0],
+                                 'enabled' if gil else 'disabled'))
+    print('%8s %12s %14s %8s' % ('threads', 'seconds', 'renders/s',
+                                 'speedup'))
+    base = None
+    for threads in args.threads:
+        seconds = run(engine, threads, args.renders)
+        rate = threads * args.renders / seconds
+        if base is None:
+            base = rate / threads
+        print('%8d %12.3f %14.0f %8.2f' % (threads, seconds, rate,
+                                           rate / base))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Compare path traversal with :data:`.defaultTraverser` (the default
+traverser of path expressions) and with :func:`.simpleTraverse`, on
+plain objects, dictionaries and sequences, both by calling the
+traversers directly and by evaluating path expressions.  Run from a
+checkout with::
+
+    python -m benchmarks.traversal [--number N] [--repeat N]
+"""
+import argparse
+import sys
+import timeit
+
+from zope.tales.engine import DefaultEngine
+from zope.tales.expressions import PathExpr
+from zope.tales.expressions import defaultTraverser
+from zope.tales.expressions import simpleTraverse
+
+
+class Object:
+    pass
+
+
+def objects():
+    c = Object()
+    c.title = 'Title'
+    b = Object()
+    b.c = c
+    o = Object()
+    o.b = b
+    return o
+
+
+# The base variable, the names traversed and whether simpleTraverse
+# can traverse them directly (it cannot index sequences by string).
+CASES = [
+    ('o', ['b', 'c', 'title'], True),
+    ('d', ['b', 'c', 'title'], True),
+    ('s', ['1', 'c', 'title'], False),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.traversal',
+        description='Compare defaultTraverser with simpleTraverse.')
+    parser.add_argument('--number', type=int, default=100000,
+                        help='the number of traversals per measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='the number of measurements kept the best of')
+    args = parser.parse_args(argv)
+
+    o = objects()
+    variables = {
+        'o': o,
+        'd': {'b': {'c': {'title': 'Title'}}},
+        's': [None, {'c': o.b.c}],
+    }
+    engine = DefaultEngine()
+    context = engine.getContext(**variables)
+    print('%-22s %12s %12s %7s' % ('case', 'default us', 'simple us',
+                                   'ratio'))
+    for base, names, direct in CASES:
+        ob = variables[base]
+        path = '/'.join([base] + names)
+        calls = [
+            ('path ' + path,
+             [lambda e=PathExpr('path', path, engine, t): e(context)
+              for t in (defaultTraverser, simpleTraverse)]),
+        ]
+        if direct:
+            calls.insert(0, (
+                'call ' + path,
+                [lambda t=t: t(ob, names, None)
+                 for t in (defaultTraverser, simpleTraverse)]))
+        for name, functions in calls:
+            times = []
+            for function in functions:
+                seconds = min(timeit.repeat(function, number=args.number,
+                                            repeat=args.repeat))
+                times.append(seconds / args.number * 1e6)
+            print('%-22s %12.3f %12.3f %7.2f' % (
+                name, times[0], times[1], times[1] / times[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
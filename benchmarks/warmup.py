@@ -0,0 +1,132 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Measure the memory of forked workers that evaluate a corpus of
+expressions, when the parent compiled nothing before forking, when it
+called :meth:`.ExpressionEngine.warmup` and when it also froze the heap
+(``warmup(..., freeze=True)``).  Run from a checkout with::
+
+    python -m benchmarks.warmup [--workers N] [--size N]
+
+Each worker evaluates the whole corpus and runs a full garbage
+collection before reading its memory from ``/proc/self/smaps_rollup``,
+so this only runs on Linux.  PSS (proportional set size) charges each
+page shared by several processes to them in equal parts; private dirty
+is the memory the worker does not share with the parent at all.  Each
+mode runs in its own interpreter, since a frozen heap stays frozen.
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+
+from zope.tales.engine import DefaultEngine
+
+
+MODES = ['none', 'warmup', 'freeze']
+FIELDS = ['Rss', 'Pss', 'Private_Dirty']
+
+
+def corpus(size):
+    expressions = []
+    for i in range(size):
+        expressions.extend([
+            'item/title%d | nothing' % i,
+            'string:${item/url}/view%d' % i,
+            'python: item.get("count%d", 0) + 1' % i,
+            'not: exists:item/hidden%d' % i,
+        ])
+    return expressions
+
+
+def memory():
+    # The fields of FIELDS in smaps_rollup, in kB.
+    result = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in FIELDS:
+                result[name] = int(value.split()[0])
+    return [result[name] for name in FIELDS]
+
+
+def work(engine, expressions):
+    context = engine.getContext(item={'url': '/item', 'title0': 'Title'})
+    for expression in expressions:
+        context.evaluate(expression)
+    gc.collect()
+
+
+def measure(mode, workers, size):
+    # Fork the workers in this interpreter; return the average memory.
+    expressions = corpus(size)
+    engine = DefaultEngine()
+    engine.compileCacheSize = max(engine.compileCacheSize, len(expressions))
+    if mode != 'none':
+        engine.warmup(expressions, freeze=mode == 'freeze')
+    pipes = []
+    for i in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            work(engine, expressions)
+            os.write(write, ('%d %d %d' % tuple(memory())).encode('ascii'))
+            os._exit(0)
+        os.close(write)
+        pipes.append((pid, read))
+    totals = [0] * len(FIELDS)
+    for pid, read in pipes:
+        with os.fdopen(read) as f:
+            values = [int(value) for value in f.read().split()]
+        os.waitpid(pid, 0)
+        totals = [total + value for total, value in zip(totals, values)]
+    return [total / workers for total in totals]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.warmup',
+        description='Measure the memory of workers with and without'
+                    ' warmup.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='the number of workers forked')
+    parser.add_argument('--size', type=int, default=2000,
+                        help='the corpus size (times 4 expressions)')
+    parser.add_argument('--mode', choices=MODES,
+                        help='measure only this mode, in this interpreter')
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, 'fork') or not os.path.exists(
+            '/proc/self/smaps_rollup'):
+        print('This benchmark needs fork() and /proc/self/smaps_rollup.')
+        return 1
+    if args.mode is not None:
+        print('%.0f %.0f %.0f' % tuple(
+            measure(args.mode, args.workers, args.size)))
+        return 0
+    print('%-8s %10s %10s %14s' % ('mode', 'RSS kB', 'PSS kB',
+                                   'private kB'))
+    for mode in MODES:
+        output = subprocess.check_output([
+            sys.executable, '-m', 'benchmarks.warmup', '--mode', mode,
+            '--workers', str(args.workers), '--size', str(args.size)])
+        rss, pss, private = [float(value) for value in output.split()]
+        print('%-8s %10.0f %10.0f %14.0f' % (mode, rss, pss, private))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
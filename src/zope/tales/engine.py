@@ -15,9 +15,13 @@
 
 Each expression engine can have its own expression types and base names.
 """
+from zope.tales.expressions import AndExpr
+from zope.tales.expressions import CachedExpr
 from zope.tales.expressions import DeferExpr
+from zope.tales.expressions import IfExpr
 from zope.tales.expressions import LazyExpr
 from zope.tales.expressions import NotExpr
+from zope.tales.expressions import OrExpr
 from zope.tales.expressions import PathExpr
 from zope.tales.expressions import SimpleModuleImporter
 from zope.tales.expressions import StringExpr
@@ -42,6 +46,14 @@ def DefaultEngine():
         :class:`.DeferExpr`
     ``lazy``
         :class:`.LazyExpr`
+    ``and``
+        :class:`.AndExpr`
+    ``or``
+        :class:`.OrExpr`
+    ``if``
+        :class:`.IfExpr`
+    ``cached``
+        :class:`.CachedExpr`
     ``modules``
         :class:`.SimpleModuleImporter`
 
@@ -58,6 +70,10 @@ def DefaultEngine():
     reg('not', NotExpr)
     reg('defer', DeferExpr)
     reg('lazy', LazyExpr)
+    reg('and', AndExpr)
+    reg('or', OrExpr)
+    reg('if', IfExpr)
+    reg('cached', CachedExpr)
     e.registerBaseName('modules', SimpleModuleImporter())
     return e
 
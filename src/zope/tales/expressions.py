@@ -21,14 +21,19 @@ object itself is a callable object taking one argument, *econtext*, which is
 the local expression namespace.
 
 """
+import importlib.util
 import re
+import sys
 
 from zope.interface import implementer
 
+from zope.tales import ir
 from zope.tales.interfaces import ITALESExpression
 from zope.tales.interfaces import ITALESFunctionNamespace
 from zope.tales.tales import NAME_RE
+from zope.tales.tales import SourceText
 from zope.tales.tales import Undefined
+from zope.tales.tales import _ContextReference
 from zope.tales.tales import _parse_expr
 from zope.tales.tales import _valid_name
 
@@ -37,6 +42,33 @@ Undefs = (Undefined, AttributeError, LookupError, TypeError)
 
 _marker = object()
 namespace_re = re.compile(r'(\w+):(.+)')
+# Path segments indexing sequences: integers written canonically.
+_isIndex = re.compile(r'0|[1-9][0-9]*').fullmatch
+
+
+def _share(engine, items):
+    # Equal tuples of path segments (and compiled paths) are shared by
+    # the expressions compiled by an engine.
+    share = getattr(engine, '_shareTuple', None)
+    if share is None:
+        return tuple(items)
+    return share(items)
+
+
+def _dependencies(exprs):
+    """Return the union of the dependencies of *exprs*, or `None` if
+    one of them cannot tell its dependencies."""
+    result = set()
+    for expr in exprs:
+        expr = getattr(expr, '__self__', expr)
+        dependencies = getattr(expr, 'dependencies', None)
+        if dependencies is None:
+            return None
+        dependencies = dependencies()
+        if dependencies is None:
+            return None
+        result.update(dependencies)
+    return frozenset(result)
 
 
 def simpleTraverse(object, path_items, econtext):
@@ -55,17 +87,144 @@ def simpleTraverse(object, path_items, econtext):
     return object
 
 
+def _traverseObject(ob, name, econtext):
+    # A single step of simpleTraverse.
+    next = getattr(ob, name, _marker)
+    if next is not _marker:
+        return next
+    if hasattr(ob, '__getitem__'):
+        return ob[name]
+    return getattr(ob, name)
+
+
+_dict_names = frozenset(dir(dict))
+
+
+def _traverseDict(ob, name, econtext):
+    # Plain dictionaries have no attributes but those of their class,
+    # so other names can only be items.
+    if type(ob) is dict and name not in _dict_names:
+        return ob[name]
+    return _traverseObject(ob, name, econtext)
+
+
+def _traverseSequence(ob, name, econtext):
+    if _isIndex(name):
+        return ob[int(name)]
+    return _traverseObject(ob, name, econtext)
+
+
+class TraverserRegistry:
+    """
+    A traverser (like :func:`simpleTraverse`) that looks up how to
+    traverse each object in a registry of functions keyed by type.
+
+    The function registered for the nearest class in the method
+    resolution order of the type of the object is used, and this
+    lookup is cached for up to :attr:`dispatchCacheSize` types (the
+    cache is emptied when it is full, so that it does not keep
+    classes alive forever).  The functions are called with the object,
+    the name to traverse to and the context, and return the object
+    found.
+
+    By default, objects are traversed like :func:`simpleTraverse`
+    does, except that plain dictionaries look up names that are not
+    dictionary attributes as items directly, and that lists and tuples
+    are indexed by names that are integers (written like ``0`` or
+    ``12``, not ``012``).  These default steps are inlined.
+    """
+
+    #: The maximum number of types whose function is cached.
+    dispatchCacheSize = 256
+
+    def __init__(self):
+        self._steps = {object: _traverseObject}
+        self._dispatch = {}
+
+    def register(self, type, step):
+        """Register the function *step* to traverse instances of *type*.
+        """
+        steps = dict(self._steps)
+        steps[type] = step
+        self._steps = steps
+        self._dispatch = {}
+
+    def lookup(self, type):
+        """Return the function used to traverse instances of *type*."""
+        dispatch = self._dispatch
+        try:
+            return dispatch[type]
+        except KeyError:
+            pass
+        steps = self._steps
+        for base in type.__mro__:
+            step = steps.get(base)
+            if step is not None:
+                break
+        else:
+            step = _traverseObject
+        if len(dispatch) >= self.dispatchCacheSize:
+            # Replaced rather than cleared: other threads may be
+            # reading it.
+            self._dispatch = dispatch = {}
+        dispatch[type] = step
+        return step
+
+    def observedTypes(self):
+        """Return the types of the objects traversed so far (since the
+        cache was last emptied)."""
+        return list(self._dispatch)
+
+    def __call__(self, object, path_items, econtext):
+        dispatch = self._dispatch
+        for name in path_items:
+            ob_type = type(object)
+            step = dispatch.get(ob_type)
+            if step is None:
+                step = self.lookup(ob_type)
+            if step is _traverseDict:
+                if ob_type is dict and name not in _dict_names:
+                    object = object[name]
+                    continue
+            elif step is not _traverseObject:
+                object = step(object, name, econtext)
+                continue
+            # The step of simpleTraverse, inlined.
+            next = getattr(object, name, _marker)
+            if next is not _marker:
+                object = next
+            elif hasattr(object, '__getitem__'):
+                object = object[name]
+            else:
+                # Allow AttributeError to propagate
+                object = getattr(object, name)
+        return object
+
+
+defaultTraverser = TraverserRegistry()
+defaultTraverser.register(dict, _traverseDict)
+defaultTraverser.register(list, _traverseSequence)
+defaultTraverser.register(tuple, _traverseSequence)
+
+
 class SubPathExpr:
     """
     Implementation of a single path expression.
     """
 
+    # Names available as path bases when they are not variables.  This
+    # is shared by all threads and must not be changed once expressions
+    # are evaluated; subclasses override it instead.
     ALLOWED_BUILTINS = {}
 
     def __init__(self, path, traverser, engine):
         self._traverser = traverser
         self._engine = engine
 
+        # Only the built-in traversers may be bypassed to index
+        # sequences: others may check the access (for security).
+        indexing = traverser in (simpleTraverse, defaultTraverser)
+
         # Parse path
         compiledpath = []
         currentpath = []
@@ -81,17 +240,17 @@ class SubPathExpr:
                     'Path element may not be empty in %r' % path)
             if element.startswith('?'):
                 if currentpath:
-                    compiledpath.append(tuple(currentpath))
+                    compiledpath.append(_share(engine, currentpath))
                     currentpath = []
                 if not _valid_name(element[1:]):
                     raise engine.getCompilerError()(
                         'Invalid variable name "%s"' % element[1:])
-                compiledpath.append(element[1:])
+                compiledpath.append(sys.intern(element[1:]))
             else:
                 match = namespace_re.match(element)
                 if match:
                     if currentpath:
-                        compiledpath.append(tuple(currentpath))
+                        compiledpath.append(_share(engine, currentpath))
                         currentpath = []
                     namespace, functionname = match.groups()
                     if not _valid_name(namespace):
@@ -103,12 +262,21 @@ class SubPathExpr:
                     except KeyError:
                         raise engine.getCompilerError()(
                             'Unknown namespace "%s"' % namespace)
-                    currentpath.append(functionname)
+                    currentpath.append(sys.intern(functionname))
+                elif (_isIndex(element) and indexing
+                      and (compiledpath or currentpath)):
+                    # Numeric segments index sequences directly.
+                    if currentpath:
+                        compiledpath.append(_share(engine, currentpath))
+                        currentpath = []
+                    compiledpath.append(int(element))
                 else:
-                    currentpath.append(element)
+                    # Interned segments are shared by all expressions
+                    # (and by the attribute names they look up).
+                    currentpath.append(sys.intern(element))
 
         if currentpath:
-            compiledpath.append(tuple(currentpath))
+            compiledpath.append(_share(engine, currentpath))
 
         first = compiledpath[0]
 
@@ -126,8 +294,45 @@ class SubPathExpr:
             raise engine.getCompilerError()(
                 'Invalid variable name "%s"' % base)
         self._base = base
-        compiledpath[0] = first[1:]
-        self._compiled_path = tuple(compiledpath)
+        compiledpath[0] = _share(engine, first[1:])
+        self._compiled_path = _share(engine, compiledpath)
+
+    def dependencies(self):
+        """
+        Return the paths this expression reads, as a frozenset of tuples
+        of names starting with a variable name.
+
+        The path stops before a namespace function or a ``?`` dynamic
+        name, whose variable is another dependency.
+        """
+        path = [self._base or 'CONTEXTS']
+        result = set()
+        for element in self._compiled_path:
+            if isinstance(element, tuple):
+                path.extend(element)
+            elif isinstance(element, int):
+                path.append(str(element))
+            else:
+                if isinstance(element, str):
+                    result.add((element,))
+                break
+        result.add(tuple(path))
+        return frozenset(result)
+
+    def toIR(self):
+        parts = [self._base]
+        for element in self._compiled_path:
+            if isinstance(element, tuple):
+                parts.extend(element)
+            elif isinstance(element, int):
+                parts.append(str(element))
+            elif isinstance(element, str):
+                parts.append('?' + element)
+            else:
+                parts.append('%s:' % getattr(element, '__name__', '?'))
+        return ir.Leaf(
+            self._eval, 'path ' + '/'.join(parts),
+            (type(self), self._base, self._compiled_path, self._traverser))
 
     def _eval(self, econtext,
               isinstance=isinstance):
@@ -158,6 +363,12 @@ class SubPathExpr:
                 if isinstance(val, str):
                     val = (val,)
                 ob = self._traverser(ob, val, econtext)
+            elif isinstance(element, int):
+                if isinstance(ob, (list, tuple)):
+                    ob = ob[element]
+                else:
+                    # Mappings (and anything else) get the string key.
+                    ob = self._traverser(ob, (str(element),), econtext)
             elif callable(element):
                 ob = element(ob)
                 # TODO: Once we have n-ary adapters, use them.
@@ -167,6 +378,74 @@ class SubPathExpr:
                 raise ValueError(repr(element))
         return ob
 
+    def _probe(self, econtext):
+        """
+        Cheaply tell whether evaluating this path may succeed.
+
+        A false result means evaluating it would certainly fail.  This
+        has no side effects: it only looks up the base variable and, as
+        long as they are plain dictionaries, the objects it contains.
+        """
+        base = self._base
+        if base == 'CONTEXTS' or not base:
+            return True
+        vars = econtext.vars
+        if base in vars:
+            ob = vars[base]
+        else:
+            return base in self.ALLOWED_BUILTINS
+        compiled_path = self._compiled_path
+        if (self._traverser in (simpleTraverse, defaultTraverser)
+                and compiled_path
+                and isinstance(compiled_path[0], tuple)):
+            for name in compiled_path[0]:
+                if type(ob) is not dict or hasattr(dict, name):
+                    break
+                if name not in ob:
+                    return False
+                ob = ob[name]
+        return True
+
+
+class _AlternativeStats:
+    """
+    Statistics about which ``|`` alternative of a path expression
+    succeeds, used to skip the alternatives that usually fail.
+
+    The counters are not synchronized: threads evaluating the
+    expression at the same time may lose updates, which only skews
+    the choice of the likely alternative (the alternatives skipped are
+    always proven to fail).
+    """
+
+    def __init__(self, probes):
+        self.probes = probes
+        self.successes = [0] * len(probes)
+        self.likely = 0
+        self.skipped = 0
+
+    def start(self, econtext):
+        # Skip the alternatives before the most likely one that probe
+        # as certain failures.  The others are evaluated as usual, so
+        # the result is always the first alternative that succeeds.
+        i = 0
+        likely = self.likely
+        probes = self.probes
+        while i < likely:
+            probe = probes[i]
+            if probe is None or probe(econtext):
+                break
+            i += 1
+        if i:
+            self.skipped += i
+        return i
+
+    def record(self, i):
+        successes = self.successes
+        successes[i] += 1
+        if successes[i] > successes[self.likely]:
+            self.likely = i
+
 
 @implementer(ITALESExpression)
 class PathExpr:
@@ -186,13 +465,21 @@ class PathExpr:
 
     SUBEXPR_FACTORY = SubPathExpr
 
+    _s = SourceText()
+
+    # Set to true in subclasses to count which alternative succeeds and
+    # skip the alternatives that usually fail when they can be cheaply
+    # proven to fail (see :meth:`getStats`).
+    ADAPTIVE = False
+    _stats = None
+
     def __init__(self, name, expr, engine, traverser=simpleTraverse):
         self._s = expr
         self._name = name
         self._hybrid = False
         paths = expr.split('|')
-        self._subexprs = []
-        add = self._subexprs.append
+        subexprs = []
+        add = subexprs.append
         for i, path in enumerate(paths):
             path = path.lstrip()
             if _parse_expr(path):
@@ -202,8 +489,59 @@ class PathExpr:
                 self._hybrid = True
                 break
             add(self.SUBEXPR_FACTORY(path, traverser, engine)._eval)
+        self._subexprs = tuple(subexprs)
+        if self.ADAPTIVE:
+            self._stats = _AlternativeStats([
+                getattr(getattr(expr, '__self__', None), '_probe', None)
+                for expr in self._subexprs])
+
+    def dependencies(self):
+        """
+        Return the paths read by the alternatives (see
+        :meth:`SubPathExpr.dependencies`), or `None` if a trailing
+        expression of another type cannot tell them.
+        """
+        return _dependencies(self._subexprs)
+
+    def subexpressions(self):
+        return self._subexprs[-1:] if self._hybrid else ()
+
+    def toIR(self):
+        if self._stats is not None:
+            return ir.Leaf(self, repr(self))
+        options = []
+        for expr in self._subexprs:
+            if self._hybrid and expr is self._subexprs[-1]:
+                options.append(ir.toIR(expr))
+                continue
+            toIR = getattr(getattr(expr, '__self__', None), 'toIR', None)
+            options.append(ir.Leaf(expr) if toIR is None else toIR())
+        if self._name in ('exists', 'nocall'):
+            mode = self._name
+        else:
+            mode = 'call'
+        return ir.Alternatives(tuple(options), mode, Undefs, self._hybrid)
+
+    def getStats(self):
+        """
+        Return the statistics of an adaptive expression, or `None`.
+
+        This is a mapping with the number of times each alternative
+        succeeded (``successes``), the alternative currently tried first
+        (``likely``) and the number of alternatives skipped because they
+        were proven to fail (``skipped``).
+        """
+        stats = self._stats
+        if stats is None:
+            return None
+        return {'successes': list(stats.successes),
+                'likely': stats.likely,
+                'skipped': stats.skipped}
 
     def _exists(self, econtext):
+        stats = self._stats
+        if stats is not None:
+            return self._existsAdaptive(econtext, stats)
         for expr in self._subexprs:
             try:
                 expr(econtext)
@@ -213,7 +551,22 @@ class PathExpr:
                 return 1
         return 0
 
+    def _existsAdaptive(self, econtext, stats):
+        subexprs = self._subexprs
+        for i in range(stats.start(econtext), len(subexprs)):
+            try:
+                subexprs[i](econtext)
+            except Undefs:
+                pass
+            else:
+                stats.record(i)
+                return 1
+        return 0
+
     def _eval(self, econtext):
+        stats = self._stats
+        if stats is not None:
+            return self._evalAdaptive(econtext, stats)
         for expr in self._subexprs[:-1]:
             # Try all but the last subexpression, skipping undefined ones.
             try:
@@ -242,6 +595,29 @@ class PathExpr:
             return ob()
         return ob
 
+    def _evalAdaptive(self, econtext, stats):
+        subexprs = self._subexprs
+        last = len(subexprs) - 1
+        for i in range(stats.start(econtext), last):
+            try:
+                ob = subexprs[i](econtext)
+            except Undefs:
+                pass
+            else:
+                stats.record(i)
+                break
+        else:
+            ob = subexprs[last](econtext)
+            stats.record(last)
+            if self._hybrid:
+                return ob
+
+        if self._name == 'nocall':
+            return ob
+        if getattr(ob, '__call__', _marker) is not _marker:
+            return ob()
+        return ob
+
     def __call__(self, econtext):
         if self._name == 'exists':
             return self._exists(econtext)
@@ -268,39 +644,82 @@ class StringExpr:
     interpreted as path expressions to evaluate.
     """
 
+    _s = SourceText()
+
     def __init__(self, name, expr, engine):
         self._s = expr
-        if '%' in expr:
-            expr = expr.replace('%', '%%')
-        self._vars = vars = []
+        # Static text alternating with the path expressions interpolated
+        # between them, starting and ending with (maybe empty) text.
+        segments = []
+        static = []
         if '$' in expr:
-            # Use whatever expr type is registered as "path".
-            path_type = engine.getTypes()['path']
-            parts = []
-            for exp in expr.split('$$'):
-                if parts:
-                    parts.append('$')
+            # Use whatever expr type is registered as "path", through
+            # the engine so that identical paths share one object.
+            for i, exp in enumerate(expr.split('$$')):
+                if i:
+                    static.append('$')
                 m = _interp.search(exp)
                 while m is not None:
-                    parts.append(exp[:m.start()])
-                    parts.append('%s')
-                    vars.append(path_type(
-                        'path', m.group(1) or m.group(2), engine))
+                    static.append(exp[:m.start()])
+                    segments.append(''.join(static))
+                    static = []
+                    var = engine.compile('path:' + (m.group(1) or m.group(2)))
+                    segments.append(var)
                     exp = exp[m.end():]
                     m = _interp.search(exp)
                 if '$' in exp:
                     raise engine.getCompilerError()(
                         '$ must be doubled or followed by a simple path')
-                parts.append(exp)
-            expr = ''.join(parts)
-        self._expr = expr
+                static.append(exp)
+        else:
+            static.append(expr)
+        segments.append(''.join(static))
+        self._segments = tuple(segments)
+
+    @property
+    def _vars(self):
+        # The path expressions, between the static text segments.
+        return list(self._segments[1::2])
 
     def __call__(self, econtext):
-        vvals = []
-        for var in self._vars:
-            v = var(econtext)
-            vvals.append(v)
-        return self._expr % tuple(vvals)
+        segments = self._segments
+        # Specialize the common cases of no, one and two interpolations.
+        n = len(segments)
+        if n == 1:
+            return segments[0]
+        if n == 3:
+            return (segments[0] + str(segments[1](econtext))
+                    + segments[2])
+        if n == 5:
+            return (segments[0] + str(segments[1](econtext))
+                    + segments[2] + str(segments[3](econtext))
+                    + segments[4])
+        parts = list(segments)
+        for i in range(1, n, 2):
+            parts[i] = str(segments[i](econtext))
+        return ''.join(parts)
+
+    def evaluateInto(self, econtext, write):
+        """
+        Write the text of this expression piecewise to the callable
+        *write*, without building the whole string first.
+        """
+        for i, segment in enumerate(self._segments):
+            if i % 2:
+                write(str(segment(econtext)))
+            elif segment:
+                write(segment)
+
+    def dependencies(self):
+        return _dependencies(self._vars)
+
+    def subexpressions(self):
+        return tuple(self._vars)
+
+    def toIR(self):
+        return ir.Concat(tuple(
+            ir.toIR(segment) if i % 2 else ir.Const(segment)
+            for i, segment in enumerate(self._segments)))
 
     def __str__(self):
         return 'string expression (%s)' % repr(self._s)
@@ -316,21 +735,258 @@ class NotExpr:
     of its sub-expression.
     """
 
+    _s = SourceText()
+
     def __init__(self, name, expr, engine):
         self._s = expr = expr.lstrip()
-        self._c = engine.compile(expr)
+        c = engine.compile(expr)
+        # Only the innermost operand of nested not: expressions is
+        # evaluated, through econtext.evaluateBoolean (which contexts
+        # may customize) unless _test tells its truth directly.
+        self._invert = True
+        self._test = None
+        if type(c) is NotExpr:
+            self._invert = not c._invert
+            self._test = c._test
+            c = c._c
+        elif (isinstance(c, PathExpr) and c._name == 'exists'
+              and type(c).__call__ is PathExpr.__call__):
+            self._test = c._exists
+        elif type(c) in (DeferExpr, LazyExpr):
+            # Deferred values are always true.
+            self._test = _true
+        self._c = c
 
     def __call__(self, econtext):
-        return int(not econtext.evaluateBoolean(self._c))
+        test = self._test
+        if test is None:
+            value = econtext.evaluateBoolean(self._c)
+        else:
+            value = test(econtext)
+        return int(not value) if self._invert else int(bool(value))
+
+    def dependencies(self):
+        return _dependencies((self._c,))
+
+    def subexpressions(self):
+        return (self._c,)
+
+    def toIR(self):
+        node = ir.toIR(self._c)
+        return ir.Not(node) if self._invert else ir.Truth(node)
 
     def __repr__(self):
         return '<NotExpr %s>' % repr(self._s)
 
 
-class DeferWrapper:
+def _true(econtext):
+    return True
+
+
+_closing = {'(': ')', '[': ']', '{': '}'}
+
+
+# Operands whose commas may be nested: python: expressions, possibly
+# wrapped in not:, defer: or lazy:.
+_python_operand = re.compile(r'\s*(?:(?:not|defer|lazy):\s*)*python:').match
+# Operands whose text may contain commas of their own.
+_string_operand = re.compile(r'\s*(?:(?:not|defer|lazy):\s*)*string:').match
+
+
+def _check_operand(previous, operand, engine, expr):
+    """Raise a compiler error if the comma between *previous* and
+    *operand* may belong to the text of a ``string:`` operand, that is
+    unless *operand* starts with the prefix of an expression type."""
+    if _string_operand(previous) is None:
+        return
+    m = _parse_expr(operand)
+    if m is None or m.group(1) not in engine.getTypes():
+        raise engine.getCompilerError()(
+            'Ambiguous comma after %r in %r: prefix the next operand '
+            'with its type (like path:), or use python: for text with '
+            'commas' % (previous, expr))
+
+
+def _split_operands(expr, engine, maxsplit=-1):
+    """Split *expr* at the commas that are not nested in brackets,
+    braces, parentheses or quotes of ``python:`` operands, at most
+    *maxsplit* times.
+
+    Unless *maxsplit* is given, the operands following ``string:``
+    operands must have a type prefix (see :func:`_check_operand`).
+    """
+    operands = []
+    nesting = []
+    quote = None
+    start = 0
+    python = _python_operand(expr) is not None
+    i = 0
+    while i < len(expr):
+        c = expr[i]
+        if quote is not None:
+            if c == '\\':
+                i += 1
+            elif c == quote:
+                quote = None
+        elif python and c in '\'"':
+            quote = c
+        elif python and c in _closing:
+            nesting.append(_closing[c])
+        elif nesting and c == nesting[-1]:
+            nesting.pop()
+        elif c == ',' and not nesting and len(operands) != maxsplit:
+            operands.append(expr[start:i])
+            start = i + 1
+            python = _python_operand(expr, start) is not None
+        i += 1
+    if quote is not None:
+        raise engine.getCompilerError()(
+            'Unclosed quote in %r' % expr)
+    operands.append(expr[start:])
+    operands = [operand.strip() for operand in operands]
+    if not all(operands):
+        raise engine.getCompilerError()(
+            'Operand may not be empty in %r' % expr)
+    if maxsplit < 0:
+        for i in range(1, len(operands)):
+            _check_operand(operands[i - 1], operands[i], engine, expr)
+    return operands
+
+
+@implementer(ITALESExpression)
+class AndExpr:
+    """
+    An expression that evaluates its comma separated sub-expressions
+    from left to right, stopping at the first false value.
+
+    The result is that value, or the value of the last
+    sub-expression if all of them are true, just like Python's
+    ``and``::
+
+       <a tal:condition="and: exists:user, user/is_admin">...</a>
+
+    Commas nested in parentheses, brackets, braces or quotes of
+    ``python:`` sub-expressions do not separate sub-expressions, so
+    they can call functions with several arguments.  The text of
+    ``string:`` sub-expressions cannot contain commas: the
+    sub-expression following one must start with its type (like
+    ``path:``), so that a comma meant as text is a compiler error.
+    """
+
+    _s = SourceText()
+
+    def __init__(self, name, expr, engine):
+        self._s = expr
+        self._c = tuple(engine.compile(operand)
+                        for operand in _split_operands(expr, engine))
+
+    def __call__(self, econtext):
+        for c in self._c:
+            value = c(econtext)
+            if not value:
+                break
+        return value
+
+    def dependencies(self):
+        return _dependencies(self._c)
+
+    def subexpressions(self):
+        return self._c
+
+    def toIR(self):
+        return ir.And(tuple(ir.toIR(c) for c in self._c))
+
+    def __repr__(self):
+        return '<AndExpr %s>' % repr(self._s)
+
+
+class OrExpr(AndExpr):
+    """
+    An expression that evaluates its comma separated sub-expressions
+    from left to right, stopping at the first true value.
+
+    The result is that value, or the value of the last
+    sub-expression if all of them are false, just like Python's
+    ``or``.  Sub-expressions are separated as in :class:`AndExpr`.
+    """
+
+    def __call__(self, econtext):
+        for c in self._c:
+            value = c(econtext)
+            if value:
+                break
+        return value
+
+    def toIR(self):
+        return ir.Or(tuple(ir.toIR(c) for c in self._c))
+
+    def __repr__(self):
+        return '<OrExpr %s>' % repr(self._s)
+
+
+@implementer(ITALESExpression)
+class IfExpr:
+    """
+    A conditional expression: ``if: condition, then[, else]``.
+
+    Only one of the *then* and *else* sub-expressions is evaluated,
+    depending on the truth of *condition*.  Without an *else*
+    sub-expression the result is `None` if *condition* is false.
+    Sub-expressions are separated as in :class:`AndExpr`.
+    """
+
+    _s = SourceText()
+
+    def __init__(self, name, expr, engine):
+        self._s = expr
+        operands = _split_operands(expr, engine)
+        if len(operands) not in (2, 3):
+            raise engine.getCompilerError()(
+                'if: expects a condition, a then and an optional else '
+                'expression, got %r' % expr)
+        compiled = [engine.compile(operand) for operand in operands]
+        if len(compiled) == 2:
+            compiled.append(None)
+        self._condition, self._then, self._else = compiled
+
+    def __call__(self, econtext):
+        if self._condition(econtext):
+            return self._then(econtext)
+        if self._else is not None:
+            return self._else(econtext)
+        return None
+
+    def dependencies(self):
+        return _dependencies(self.subexpressions())
+
+    def subexpressions(self):
+        return tuple(c for c in (self._condition, self._then, self._else)
+                     if c is not None)
+
+    def toIR(self):
+        return ir.If(ir.toIR(self._condition), ir.toIR(self._then),
+                     None if self._else is None else ir.toIR(self._else))
+
+    def __repr__(self):
+        return '<IfExpr %s>' % repr(self._s)
+
+
+class DeferWrapper(_ContextReference):
+    """
+    Wrapper for defer: expressions.
+
+    Once stored in the variables of the context it was created with, a
+    wrapper only keeps a weak reference to that context, and raises a
+    :class:`~.TALESError` if called after the context was freed.
+    """
+
     def __init__(self, expr, econtext):
         self._expr = expr
-        self._econtext = econtext
+        self._setContext(econtext)
+
+    @property
+    def _econtext(self):
+        return self._getContext()
 
     def __str__(self):
         return str(self())
@@ -338,6 +994,9 @@ class DeferWrapper:
     def __call__(self):
         return self._expr(self._econtext)
 
+    def dependencies(self):
+        return _dependencies((self._expr,))
+
 
 @implementer(ITALESExpression)
 class DeferExpr:
@@ -355,6 +1014,8 @@ class DeferExpr:
        </div>
     """
 
+    _s = SourceText()
+
     def __init__(self, name, expr, compiler):
         self._s = expr = expr.lstrip()
         self._c = compiler.compile(expr)
@@ -362,6 +1023,15 @@ class DeferExpr:
     def __call__(self, econtext):
         return DeferWrapper(self._c, econtext)
 
+    def dependencies(self):
+        return _dependencies((self._c,))
+
+    def subexpressions(self):
+        return (self._c,)
+
+    def toIR(self):
+        return ir.Defer(ir.toIR(self._c), DeferWrapper)
+
     def __repr__(self):
         return '<DeferExpr %s>' % repr(self._s)
 
@@ -377,7 +1047,10 @@ class LazyWrapper(DeferWrapper):
     def __call__(self):
         r = self._result
         if r is _marker:
-            self._result = r = self._expr(self._econtext)
+            # Threads evaluating the expression at the same time all
+            # return the result stored first.
+            r = self.__dict__.setdefault(
+                '_result', self._expr(self._econtext))
         return r
 
 
@@ -393,14 +1066,137 @@ class LazyExpr(DeferExpr):
     def __call__(self, econtext):
         return LazyWrapper(self._c, econtext)
 
+    def toIR(self):
+        return ir.Defer(ir.toIR(self._c), LazyWrapper)
+
     def __repr__(self):
         return 'lazy:%s' % repr(self._s)
 
 
+_cached_option = re.compile(r'\s*(ttl|key)\s*=\s*')
+
+
+@implementer(ITALESExpression)
+class CachedExpr:
+    """
+    An expression caching the result of its sub-expression for all
+    contexts, for a number of seconds::
+
+       <span tal:content="cached: ttl=30, key=request/lang,
+                          python: modules['site'].visitors(request)"/>
+
+    The sub-expression can be preceded by comma separated options:
+    ``ttl`` is the number of seconds results are valid for
+    (:attr:`DEFAULT_TTL` by default) and ``key`` is an expression whose
+    value distinguishes cached results.  Results are stored in the
+    :attr:`~.ExpressionEngine.resultCache` of the engine that compiled
+    the expression, by the text of the expression and the value of the
+    key; they are not cached at all when the value of the key is not
+    hashable.  Exceptions are not cached.
+    """
+
+    DEFAULT_TTL = 60
+
+    def __init__(self, name, expr, engine):
+        self._s = expr
+        self._cache = engine.resultCache
+        self._ttl = self.DEFAULT_TTL
+        self._key = None
+        rest = expr
+        m = _cached_option.match(rest)
+        while m is not None:
+            operands = _split_operands(rest[m.end():], engine, 1)
+            if len(operands) < 2:
+                break
+            value, rest = operands
+            if m.group(1) == 'ttl':
+                try:
+                    self._ttl = float(value)
+                except ValueError:
+                    self._ttl = -1
+                if not self._ttl >= 0:
+                    raise engine.getCompilerError()(
+                        'Invalid ttl %r in cached expression' % value)
+            else:
+                self._key = engine.compile(value)
+            m = _cached_option.match(rest)
+            if m is None:
+                _check_operand(value, rest.strip(), engine, expr)
+        rest = rest.strip()
+        if not rest or m is not None:
+            raise engine.getCompilerError()(
+                'cached: expects an expression in %r' % expr)
+        self._c = engine.compile(rest)
+
+    def __call__(self, econtext):
+        key = self._s
+        if self._key is not None:
+            key = (key, self._key(econtext))
+        cache = self._cache
+        try:
+            result = cache.get(key, _marker)
+        except TypeError:
+            return self._c(econtext)
+        if result is _marker:
+            result = self._c(econtext)
+            cache.set(key, result, self._ttl)
+        return result
+
+    def dependencies(self):
+        return _dependencies(self.subexpressions())
+
+    def subexpressions(self):
+        if self._key is None:
+            return (self._c,)
+        return (self._key, self._c)
+
+    def toIR(self):
+        # Cached results cannot be optimized, only the sub-expressions
+        # computing them (when compiled).
+        return ir.Leaf(self, repr(self))
+
+    def __repr__(self):
+        return '<CachedExpr %s>' % repr(self._s)
+
+
 class SimpleModuleImporter:
-    """Minimal module importer with no security."""
+    """Minimal module importer with no security.
+
+    Resolved modules are cached by their dotted name.  If *allowed* is
+    given, only those dotted names can be imported; they are resolved
+    when the importer is created.  If *lazy* is true, looking up a
+    module that was not resolved yet returns a :class:`LazyModule`
+    that only imports it when one of its attributes is used, provided
+    the module can be found (otherwise it is resolved right away,
+    raising the usual error).  Finding a module imports its parent
+    packages, and only :meth:`_get_toplevel_module` can tell whether
+    a module may be imported, so modules are never looked up lazily
+    when that method is overridden.
+    """
+
+    def __init__(self, allowed=None, lazy=False):
+        self._cache = {}
+        self._lazy = lazy
+        self._allowed = None
+        if allowed is not None:
+            self._allowed = frozenset(allowed)
+            for module in self._allowed:
+                self._cache[module] = self._resolve(module)
 
     def __getitem__(self, module):
+        try:
+            return self._cache[module]
+        except KeyError:
+            pass
+        if self._allowed is not None:
+            raise ModuleNotFoundError(
+                'Module %r is not allowed' % module, name=module)
+        if (self._lazy and self._unrestricted()
+                and _findSpec(module) is not None):
+            return LazyModule(self, module)
+        return self._cache.setdefault(module, self._resolve(module))
+
+    def _resolve(self, module):
         mod = self._get_toplevel_module(module)
         path = module.split('.')
         for name in path[1:]:
@@ -410,3 +1206,50 @@ class SimpleModuleImporter:
     def _get_toplevel_module(self, module):
         # This can be overridden to add security proxies.
         return __import__(module)
+
+    def _unrestricted(self):
+        # Whether _get_toplevel_module is the one above (possibly
+        # replaced on the instance or in a subclass).
+        hook = getattr(self._get_toplevel_module, '__func__', None)
+        return hook is SimpleModuleImporter._get_toplevel_module
+
+
+def _findSpec(module):
+    # The import spec of *module* if it is a module that can be
+    # imported, importing nothing but its parent packages.
+    try:
+        return importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    Modules are not callable, so looking up ``__call__`` (like path
+    expressions do to call their result) does not import the module.
+    """
+
+    def __init__(self, importer, name):
+        self._importer = importer
+        self._name = name
+
+    def _resolve(self):
+        importer = self._importer
+        try:
+            return importer._cache[self._name]
+        except KeyError:
+            return importer._cache.setdefault(
+                self._name, importer._resolve(self._name))
+
+    def __getattr__(self, name):
+        if name == '__call__':
+            # Modules are not callable.
+            raise AttributeError(name)
+        if name in ('_importer', '_name'):
+            # Not initialized (yet), e.g. while being copied.
+            raise AttributeError(name)
+        return getattr(self._resolve(), name)
+
+    def __repr__(self):
+        return '<LazyModule %s>' % self._name
@@ -0,0 +1,546 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Intermediate representation of compiled expressions.
+
+The built-in expression types describe themselves as a tree of
+:class:`Node` objects with their ``toIR()`` method (see :func:`toIR`).
+A :class:`PassManager` rewrites such a tree with optimization passes,
+and :func:`lower` turns it back into a callable taking an
+*econtext*.  :class:`OptimizedExpression` (usually created with
+:meth:`.ExpressionEngine.optimize`) ties these together.
+
+Parts of an expression that cannot be described, like ``python:``
+expressions, are :class:`Leaf` nodes calling the original code.
+"""
+from zope.interface import implementer
+
+from zope.tales.interfaces import ITALESExpression
+
+
+_marker = object()
+
+
+class Node:
+    """
+    Base class of the nodes.
+
+    The attributes named in ``_fields`` are the children of the node
+    (nodes, tuples of nodes or `None`) or plain values.  Nodes are
+    compared by their type and fields.
+    """
+
+    _fields = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self._fields, values):
+            setattr(self, name, value)
+
+    def transform(self, function):
+        """
+        Return the result of calling *function* with this node once
+        its children have been transformed the same way.
+        """
+        values = []
+        changed = False
+        for name in self._fields:
+            value = old = getattr(self, name)
+            if isinstance(value, Node):
+                value = value.transform(function)
+            elif isinstance(value, tuple):
+                value = tuple(v.transform(function)
+                              if isinstance(v, Node) else v
+                              for v in value)
+            changed = changed or value != old
+            values.append(value)
+        node = self.__class__(*values) if changed else self
+        return function(node)
+
+    def children(self):
+        for name in self._fields:
+            value = getattr(self, name)
+            if isinstance(value, Node):
+                yield value
+            elif isinstance(value, tuple):
+                for v in value:
+                    if isinstance(v, Node):
+                        yield v
+
+    def label(self):
+        return self.__class__.__name__
+
+    def explain(self, indent=0):
+        """Return a textual dump of this tree."""
+        lines = ['  ' * indent + self.label()]
+        for child in self.children():
+            lines.append(child.explain(indent + 1))
+        return '\n'.join(lines)
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__
+                and self._key() == other._key())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.__class__, self._key()))
+
+    def __repr__(self):
+        return '<%s>' % self.label()
+
+
+class Const(Node):
+    """A constant *value*."""
+
+    _fields = ('value',)
+
+    def label(self):
+        return 'Const %r' % (self.value,)
+
+    def _key(self):
+        return (type(self.value), self.value)
+
+
+class Leaf(Node):
+    """
+    Code that is not described further: *function* is called with the
+    econtext.  Leaves with the same *key* (if not `None`) are assumed
+    to compute the same thing.
+    """
+
+    _fields = ('function', 'description', 'key')
+
+    def __init__(self, function, description=None, key=None):
+        if description is None:
+            description = repr(function)
+        Node.__init__(self, function, description, key)
+
+    def label(self):
+        return 'Leaf %s' % self.description
+
+    def _key(self):
+        if self.key is None:
+            return (id(self.function),)
+        return self.key
+
+
+class Alternatives(Node):
+    """
+    The ``|`` alternatives of a path expression: the first of the
+    *options* not raising one of the exceptions in *catch*, the last
+    one being evaluated without catching anything.
+
+    *mode* is ``'exists'`` (the result is 1 or 0), ``'nocall'`` or
+    ``'call'``, calling the result if it is callable and *hybrid* is
+    false or the last option was not used.
+    """
+
+    _fields = ('options', 'mode', 'catch', 'hybrid')
+
+    def label(self):
+        return 'Alternatives %s%s' % (
+            self.mode, ' hybrid' if self.hybrid else '')
+
+
+class Concat(Node):
+    """The text of the *parts*, joined."""
+
+    _fields = ('parts',)
+
+
+class Not(Node):
+    """1 if *operand* is false according to the econtext, else 0."""
+
+    _fields = ('operand',)
+
+
+class Truth(Node):
+    """1 if *operand* is true according to the econtext, else 0."""
+
+    _fields = ('operand',)
+
+
+class Defer(Node):
+    """An instance of *wrapper* evaluating *operand* when called."""
+
+    _fields = ('operand', 'wrapper')
+
+    def label(self):
+        return 'Defer %s' % self.wrapper.__name__
+
+
+class And(Node):
+    """The first false operand, or the last one."""
+
+    _fields = ('operands',)
+
+
+class Or(Node):
+    """The first true operand, or the last one."""
+
+    _fields = ('operands',)
+
+
+class If(Node):
+    """*then* if *condition* is true, else *otherwise*."""
+
+    _fields = ('condition', 'then', 'otherwise')
+
+
+# Methods of expression classes that toIR() and specialize() must be
+# defined with to describe them.
+_behavior = frozenset(('__call__', '_eval', '_exists', '_bind_used_names'))
+
+
+def _method(expression, name):
+    # Return the method *name* of *expression*, unless a subclass
+    # changed how it is evaluated without overriding it.
+    for klass in type(expression).__mro__:
+        if name in klass.__dict__:
+            return getattr(expression, name)
+        if not _behavior.isdisjoint(klass.__dict__):
+            break
+    return None
+
+
+def toIR(expression):
+    """
+    Return the tree describing the compiled *expression*.
+
+    This calls its ``toIR()`` method, unless it has none or a subclass
+    changed how it is evaluated without updating it, in which case the
+    expression is a :class:`Leaf`.
+    """
+    method = _method(expression, 'toIR')
+    if method is None:
+        return Leaf(expression)
+    return method()
+
+
+def specialize(expression):
+    """
+    Return a callable evaluating the compiled *expression* like it
+    does, but faster.
+
+    This calls its ``specialize()`` method if it has one (under the
+    same conditions as :func:`toIR`), or lowers its optimized tree.
+    The result is *expression* itself if nothing can be gained.
+    """
+    method = _method(expression, 'specialize')
+    if method is not None:
+        return method()
+    node = PassManager().run(toIR(expression))
+    if isinstance(node, Leaf) and node.function is expression:
+        return expression
+    return lower(node)
+
+
+def _truth(node):
+    # Return whether the value of *node* is known to be true, or None.
+    if isinstance(node, Const):
+        return bool(node.value)
+    if isinstance(node, Defer):
+        return True
+    return None
+
+
+def foldConstants(node):
+    """Compute what only depends on constants."""
+    if isinstance(node, Concat):
+        parts = []
+        for part in node.parts:
+            if (isinstance(part, Const) and parts
+                    and isinstance(parts[-1], Const)):
+                parts[-1] = Const(str(parts[-1].value) + str(part.value))
+            elif not (isinstance(part, Const) and part.value == ''):
+                parts.append(part)
+        if not parts:
+            return Const('')
+        if len(parts) == 1 and isinstance(parts[0], Const):
+            return Const(str(parts[0].value))
+        if len(parts) != len(node.parts):
+            return Concat(tuple(parts))
+    elif isinstance(node, (Not, Truth)):
+        if isinstance(node.operand, Const):
+            truth = bool(node.operand.value)
+            return Const(int(truth if isinstance(node, Truth) else
+                             not truth))
+    elif isinstance(node, (And, Or)):
+        stop = isinstance(node, Or)
+        operands = list(node.operands)
+        i = 0
+        while i < len(operands) - 1:
+            truth = _truth(operands[i])
+            if truth is stop:
+                del operands[i + 1:]
+            elif truth is not None:
+                del operands[i]
+                continue
+            i += 1
+        if len(operands) == 1:
+            return operands[0]
+        if len(operands) != len(node.operands):
+            return node.__class__(tuple(operands))
+    elif isinstance(node, If):
+        truth = _truth(node.condition)
+        if truth is True:
+            return node.then
+        if truth is False:
+            return node.otherwise or Const(None)
+    return node
+
+
+def pruneAlternatives(node):
+    """Drop the alternatives that cannot be used."""
+    if not isinstance(node, Alternatives):
+        return node
+    options = []
+    for option in node.options:
+        if option in options:
+            # Fails just like the first time.
+            continue
+        options.append(option)
+    last = options[-1]
+    if isinstance(last, Const) and len(options) == 1:
+        if node.mode == 'exists':
+            return Const(1)
+        if node.hybrid:
+            return last
+    if len(options) != len(node.options):
+        return Alternatives(tuple(options), node.mode, node.catch,
+                            node.hybrid)
+    return node
+
+
+def simplifyNot(node):
+    """Remove double negations and negations of deferred values."""
+    if isinstance(node, Not):
+        operand = node.operand
+        if isinstance(operand, Not):
+            return Truth(operand.operand)
+        if isinstance(operand, Truth):
+            return Not(operand.operand)
+        if isinstance(operand, Defer):
+            # Wrappers are always true.
+            return Const(0)
+    elif isinstance(node, Truth):
+        operand = node.operand
+        if isinstance(operand, (Not, Truth)):
+            return operand
+        if isinstance(operand, Defer):
+            return Const(1)
+    return node
+
+
+DEFAULT_PASSES = (foldConstants, pruneAlternatives, simplifyNot)
+
+
+class PassManager:
+    """
+    Apply optimization *passes* (functions taking a node and returning
+    a replacement) to all nodes of trees, until they do not change.
+    """
+
+    #: The maximum number of times all passes are applied to a tree.
+    maxRounds = 10
+
+    def __init__(self, passes=DEFAULT_PASSES):
+        self.passes = list(passes)
+
+    def addPass(self, function):
+        self.passes.append(function)
+
+    def run(self, node):
+        for i in range(self.maxRounds):
+            before = node
+            for function in self.passes:
+                node = node.transform(function)
+            if node == before:
+                break
+        return node
+
+
+def lower(node):
+    """Return a callable taking an econtext evaluating *node*."""
+    return _lowerers[node.__class__](node)
+
+
+def _lowerConst(node):
+    value = node.value
+
+    def const(econtext):
+        return value
+    return const
+
+
+def _lowerLeaf(node):
+    return node.function
+
+
+def _lowerAlternatives(node):
+    options = tuple(lower(option) for option in node.options)
+    first, last = options[:-1], options[-1]
+    catch = node.catch
+    if node.mode == 'exists':
+        def exists(econtext):
+            for option in options:
+                try:
+                    option(econtext)
+                except catch:
+                    pass
+                else:
+                    return 1
+            return 0
+        return exists
+
+    autocall = node.mode != 'nocall'
+    hybrid = node.hybrid
+    if not first and not autocall:
+        return last
+
+    def alternatives(econtext):
+        for option in first:
+            try:
+                ob = option(econtext)
+            except catch:
+                pass
+            else:
+                break
+        else:
+            ob = last(econtext)
+            if hybrid:
+                return ob
+        if autocall and getattr(ob, '__call__', _marker) is not _marker:
+            return ob()
+        return ob
+    return alternatives
+
+
+def _lowerConcat(node):
+    parts = tuple(part.value if isinstance(part, Const) else lower(part)
+                  for part in node.parts)
+    static = tuple(isinstance(part, Const) for part in node.parts)
+
+    def concat(econtext):
+        return ''.join([part if s else str(part(econtext))
+                        for s, part in zip(static, parts)])
+    return concat
+
+
+def _lowerNot(node):
+    operand = lower(node.operand)
+
+    def not_(econtext):
+        return int(not econtext.evaluateBoolean(operand))
+    return not_
+
+
+def _lowerTruth(node):
+    operand = lower(node.operand)
+
+    def truth(econtext):
+        return int(bool(econtext.evaluateBoolean(operand)))
+    return truth
+
+
+def _lowerDefer(node):
+    operand = lower(node.operand)
+    wrapper = node.wrapper
+
+    def defer(econtext):
+        return wrapper(operand, econtext)
+    return defer
+
+
+def _lowerAnd(node):
+    operands = tuple(lower(operand) for operand in node.operands)
+
+    def and_(econtext):
+        for operand in operands:
+            value = operand(econtext)
+            if not value:
+                break
+        return value
+    return and_
+
+
+def _lowerOr(node):
+    operands = tuple(lower(operand) for operand in node.operands)
+
+    def or_(econtext):
+        for operand in operands:
+            value = operand(econtext)
+            if value:
+                break
+        return value
+    return or_
+
+
+def _lowerIf(node):
+    condition = lower(node.condition)
+    then = lower(node.then)
+    otherwise = None if node.otherwise is None else lower(node.otherwise)
+
+    def if_(econtext):
+        if condition(econtext):
+            return then(econtext)
+        if otherwise is not None:
+            return otherwise(econtext)
+        return None
+    return if_
+
+
+_lowerers = {
+    Const: _lowerConst,
+    Leaf: _lowerLeaf,
+    Alternatives: _lowerAlternatives,
+    Concat: _lowerConcat,
+    Not: _lowerNot,
+    Truth: _lowerTruth,
+    Defer: _lowerDefer,
+    And: _lowerAnd,
+    Or: _lowerOr,
+    If: _lowerIf,
+}
+
+
+@implementer(ITALESExpression)
+class OptimizedExpression:
+    """
+    A compiled *expression* evaluated through its optimized tree.
+
+    The tree is optimized by *passes* (a :class:`PassManager`, by
+    default one with the :data:`DEFAULT_PASSES`).
+    """
+
+    def __init__(self, expression, passes=None):
+        if passes is None:
+            passes = PassManager()
+        self.expression = expression
+        self.node = passes.run(toIR(expression))
+        self._call = lower(self.node)
+
+    def __call__(self, econtext):
+        return self._call(econtext)
+
+    def explain(self):
+        """Return a textual dump of the optimized tree."""
+        return self.node.explain()
+
+    def __repr__(self):
+        return '<OptimizedExpression %r>' % (self.expression,)
@@ -0,0 +1,162 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""
+Profiles of the expressions evaluated by an engine.
+
+A profile records how many times each tiered expression in the
+compile cache of an :class:`~.ExpressionEngine` was evaluated (see
+:attr:`~.ExpressionEngine.tierThreshold` and
+:attr:`~.ExpressionEngine.compileCacheSize`) and the types of the objects
+traversed by path expressions using a :class:`~.TraverserRegistry`
+(:data:`~.defaultTraverser` by default).  It is saved as a JSON file by
+:func:`exportProfile` and loaded by :func:`loadProfile` in a new
+process, to compile and specialize the hot expressions before they
+are used.
+
+Profiles of several processes can be merged with::
+
+    python -m zope.tales.profiles -o merged.json worker1.json worker2.json
+"""
+import argparse
+import json
+import sys
+
+from zope.tales.expressions import defaultTraverser
+
+
+FORMAT = 'zope.tales.profile'
+VERSION = 1
+
+
+def getProfile(engine, traverser=defaultTraverser):
+    """Return the profile of *engine* and *traverser* as a mapping."""
+    expressions = {}
+    for text, tiered in list(engine._tiered.items()):
+        if tiered.count:
+            expressions[text] = tiered.count
+    types = sorted({'{}:{}'.format(t.__module__, t.__qualname__)
+                    for t in traverser.observedTypes()})
+    return {'format': FORMAT,
+            'version': VERSION,
+            'expressions': expressions,
+            'types': types}
+
+
+def exportProfile(engine, filename, traverser=defaultTraverser):
+    """Save the profile of *engine* and *traverser* to *filename*."""
+    profile = getProfile(engine, traverser)
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=1, sort_keys=True)
+
+
+def readProfile(filename):
+    """
+    Return the profile saved in *filename*.
+
+    :raises ValueError: If the file is not a profile.
+    """
+    with open(filename) as f:
+        profile = json.load(f)
+    if (not isinstance(profile, dict) or profile.get('format') != FORMAT
+            or profile.get('version') != VERSION):
+        raise ValueError('%r is not an expression profile' % filename)
+    return profile
+
+
+def mergeProfiles(profiles):
+    """Return a profile adding up the counts of *profiles*."""
+    expressions = {}
+    types = set()
+    for profile in profiles:
+        for text, count in profile['expressions'].items():
+            expressions[text] = expressions.get(text, 0) + count
+        types.update(profile['types'])
+    return {'format': FORMAT,
+            'version': VERSION,
+            'expressions': expressions,
+            'types': sorted(types)}
+
+
+def _resolveType(name):
+    # Only look in modules that are already imported: loading a profile
+    # must not import code.
+    module, _, qualname = name.partition(':')
+    ob = sys.modules.get(module)
+    for part in qualname.split('.'):
+        ob = getattr(ob, part, None)
+    return ob if isinstance(ob, type) else None
+
+
+def loadProfile(engine, filename, minimum=None,
+                traverser=defaultTraverser):
+    """
+    Compile the expressions of the profile saved in *filename* with
+    *engine*, and prepare *traverser* for the types it lists.
+
+    Expressions evaluated at least *minimum* times (by default the
+    :attr:`~.ExpressionEngine.tierThreshold` of *engine*) are also
+    promoted to their specialized version if *engine* is tiered.
+    Expressions that do not compile are skipped.
+
+    Returns the number of expressions compiled.
+
+    :raises ValueError: If the compile cache of *engine* is disabled
+        (see :attr:`~.ExpressionEngine.compileCacheSize`).
+    """
+    if engine.compileCacheSize == 0:
+        raise ValueError(
+            'loadProfile needs the compile cache, see compileCacheSize')
+    profile = readProfile(filename)
+    if minimum is None:
+        minimum = engine.tierThreshold or 1
+    count = 0
+    for text, hits in profile['expressions'].items():
+        if hits < minimum:
+            continue
+        try:
+            compiled = engine.compile(text)
+        except engine.getCompilerError():
+            continue
+        promote = getattr(compiled, 'promote', None)
+        if promote is not None:
+            promote()
+        count += 1
+    for name in profile['types']:
+        type_ = _resolveType(name)
+        if type_ is not None:
+            traverser.lookup(type_)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m zope.tales.profiles',
+        description='Merge expression profiles.')
+    parser.add_argument('-o', '--output', required=True,
+                        help='the file to write the merged profile to')
+    parser.add_argument('profiles', nargs='+', metavar='PROFILE',
+                        help='a profile to merge')
+    args = parser.parse_args(argv)
+    try:
+        merged = mergeProfiles([readProfile(filename)
+                                for filename in args.profiles])
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    with open(args.output, 'w') as f:
+        json.dump(merged, f, indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
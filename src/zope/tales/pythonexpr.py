@@ -13,9 +13,25 @@
 ##############################################################################
 """Generic Python Expression Handler
 """
+import dis
 import types
 
 
+# The instructions looking up a variable (rather than an attribute).
+_loadName = frozenset(('LOAD_NAME', 'LOAD_GLOBAL'))
+
+
+def _variableNames(code):
+    """Return the names *code* (and the code nested in it, like
+    comprehensions) look up as variables."""
+    names = [instruction.argval for instruction in dis.get_instructions(code)
+             if instruction.opname in _loadName]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.extend(_variableNames(const))
+    return names
+
+
 class PythonExpr:
     """
     Evaluates a python expression by calling :func:`eval` after
@@ -31,8 +47,12 @@ class PythonExpr:
         text = '\n'.join(expr.splitlines())  # normalize line endings
         text = '(' + text + ')'  # Put text in parens so newlines don't matter
         self.text = text
+        compileCode = getattr(engine, 'compilePythonCode', None)
         try:
-            code = self._compile(text, '<string>')
+            if compileCode is None:
+                code = self._compile(text, '<string>')
+            else:
+                code = compileCode(text, self._compile)
         except SyntaxError as e:
             raise engine.getCompilerError()(str(e))
         self._code = code
@@ -42,6 +62,50 @@ class PythonExpr:
         for const in code.co_consts:
             if isinstance(const, types.CodeType):
                 self._varnames += const.co_names
+        # Expression types called as functions read unknown variables.
+        getTypes = getattr(engine, 'getTypes', None)
+        self._callsTypes = getTypes is not None and not (
+            getTypes().keys().isdisjoint(self._varnames))
+
+    def dependencies(self):
+        """
+        Return the names this expression may read, as a frozenset of
+        one-name paths, or `None` if it calls an expression type.
+
+        This includes attribute names and builtins, which can be
+        variables too.
+        """
+        if self._callsTypes:
+            return None
+        return frozenset((name,) for name in self._varnames)
+
+    def specialize(self):
+        """
+        Return a callable evaluating this expression that only binds
+        the names it reads as variables, not its attribute names (see
+        :func:`zope.tales.ir.specialize`).
+        """
+        code = self._code
+        text = self.text
+        varnames = tuple(dict.fromkeys(_variableNames(code)))
+        builtins = __builtins__
+        if not isinstance(builtins, dict):
+            builtins = builtins.__dict__
+
+        def specialized(econtext):
+            __traceback_info__ = text
+            vars = econtext.vars
+            names = {'__builtins__': builtins}
+            for name in varnames:
+                value = vars.get(name, names)
+                if value is not names:
+                    names[name] = value
+                elif name not in builtins:
+                    handler = econtext._engine.getTypes().get(name)
+                    if handler is not None:
+                        names[name] = ExprTypeProxy(name, handler, econtext)
+            return eval(code, names)
+        return specialized
 
     def _compile(self, text, filename):
         return compile(text, filename, 'eval')
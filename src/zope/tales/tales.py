@@ -15,13 +15,30 @@
 
 An implementation of a TAL expression engine
 """
+import copy
+import gc
+import hashlib
+import marshal
+import mmap
 import re
+import struct
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
 from html import escape
+from importlib.util import MAGIC_NUMBER
+from types import CodeType
 
 from zope.interface import Interface
 from zope.interface import implementer
 
+from zope.tales.interfaces import ITALESExpression
 from zope.tales.interfaces import ITALESIterator
+from zope.tales.ir import OptimizedExpression
+from zope.tales.ir import specialize
+from zope.tales.ir import toIR
 
 
 class ITALExpressionEngine(Interface):
@@ -58,6 +75,13 @@ class Undefined(TALESError):
     """Exception raised on traversal of an undefined path."""
 
 
+class BudgetExceeded(TALESError):
+    """Raised when an evaluation exceeds the budget of its context.
+
+    See :meth:`Context.setBudget`.
+    """
+
+
 class CompilerError(Exception):
     """TALES Compiler Error"""
 
@@ -67,10 +91,138 @@ class RegistrationError(Exception):
 
 
 _default = object()
+_marker = object()
+
+
+class _Undefined:
+
+    def __repr__(self):
+        return 'UNDEFINED'
+
+
+#: The value of undefined paths in :meth:`Context.dependencyKey`.
+UNDEFINED = _Undefined()
+
+
+class _Identity:
+    # Stands for an unhashable value in the keys of dependencyKey(),
+    # equal to the wrappers of the same object only.  It refers to the
+    # object, so that its id is not reused while a key is kept.
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return (isinstance(other, _Identity)
+                and other.value is self.value)
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __repr__(self):
+        return '<identity of %s at 0x%x>' % (
+            type(self.value).__name__, id(self.value))
+
+
+def isLoopInvariant(expression, loopNames, volatileNames=None):
+    """
+    Tell whether the compiled *expression* gives the same result in all
+    the iterations of a loop defining the variables *loopNames*.
+
+    This is the case if it can tell its ``dependencies()`` and none of
+    them starts with one of *loopNames* or *volatileNames* (by default
+    :attr:`Context.volatileNames`, including ``repeat``).  Side effects
+    of Python expressions are not considered, nor the variables read
+    by deferred expressions (see :meth:`Context.evaluateInvariant`).
+    """
+    dependencies = getattr(expression, 'dependencies', None)
+    dependencies = dependencies() if dependencies is not None else None
+    if dependencies is None:
+        return False
+    if volatileNames is None:
+        volatileNames = Context.volatileNames
+    return not any(path[0] in loopNames or path[0] in volatileNames
+                   for path in dependencies)
+
+
+# The source text of the expressions compiled by engines with
+# dropSourceText and keepDroppedSource set.
+_droppedSources = weakref.WeakKeyDictionary()
+
+
+class SourceText:
+    """
+    The ``_s`` attribute (source text) of expression classes, for
+    instances whose text was dropped by an engine with
+    :attr:`~ExpressionEngine.dropSourceText` set.
+
+    The text is then looked up in an external table, or is empty if the
+    engine did not keep it.
+    """
+
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        return _droppedSources.get(inst, '')
+
+
+# Bundles start with this magic, followed by the length of the marshalled
+# header, the header itself (fingerprint and index) and the records.
+_BUNDLE_MAGIC = b'ZTALESB1'
+_BUNDLE_HEADER = struct.Struct('<I')
+
+
+class _ContextReference:
+    # Base class of the objects created with a context that may end up
+    # in its variables, like repeat iterators and defer: wrappers.
+    # They refer to the context strongly until it stores them, when it
+    # calls _weaken() so that the reference cycle does not keep a
+    # finished render alive.  They also remember the render of the
+    # context (counted by Context.reset) they were created for, so
+    # that they do not act on the variables of the next one.
+
+    _contextRef = None
+
+    def _setContext(self, context):
+        self._context = context
+        self._render = (context._renders if isinstance(context, Context)
+                        else None)
+
+    def _weaken(self):
+        context = self._context
+        if context is not None:
+            try:
+                self._contextRef = weakref.ref(context)
+            except TypeError:
+                return
+            self._context = None
+
+    def _getContext(self):
+        context = self._context
+        if context is None:
+            context = self._contextRef()
+            if context is None:
+                raise TALESError(
+                    '%s used after its context was freed'
+                    % type(self).__name__)
+        if self._render is not None and context._renders != self._render:
+            raise TALESError(
+                '%s used after its context was reset'
+                % type(self).__name__)
+        return context
+
+
+def _stored(context, value):
+    # Called by a context storing *value* in its variables.
+    if (isinstance(value, _ContextReference)
+            and value._context is context):
+        value._weaken()
 
 
 @implementer(ITALESIterator)
-class Iterator:
+class Iterator(_ContextReference):
     """
     TALES Iterator.
 
@@ -118,7 +270,7 @@ class Iterator:
         self._iter = i = iter(seq)
         self._nextIndex = 0
         self._name = name
-        self._setLocal = context.setLocal
+        self._setContext(context)
 
         # This is tricky. We want to know if we are on the last item,
         # but we can't know that without trying to get it. :(
@@ -174,6 +326,9 @@ class Iterator:
         # Note that these are *NOT* Python iterators!
         if self._done:
             return False
+        context = self._getContext()
+        if isinstance(context, Context) and context._budget is not None:
+            context._budget.step()
         self._item = v = self._next
         try:
             self._next = next(self._iter)
@@ -182,7 +337,7 @@ class Iterator:
             self._last = True
 
         self._nextIndex += 1
-        self._setLocal(self._name, v)
+        context.setLocal(self._name, v)
         return True
 
     def index(self):
@@ -556,11 +711,57 @@ class ExpressionEngine:
     instances supporting the standard expression types.
     """
 
+    #: The maximum number of contexts pooled per thread, see
+    #: :meth:`releaseContext`.
+    contextPoolSize = 4
+
+    #: The maximum number of compiled expressions cached by
+    #: :meth:`compile` (the oldest ones are evicted), or `None` for no
+    #: limit.  The cache is disabled by default (0), since it makes
+    #: :meth:`compile` return the same object, and thus the same
+    #: mutable state, for every use of the same text.
+    compileCacheSize = 0
+
+    #: The number of evaluations after which expressions are
+    #: specialized, or `None` not to return tiered expressions from
+    #: :meth:`compile`.
+    tierThreshold = None
+
+    #: Called with each :class:`TieredExpression` when it is promoted.
+    onPromotion = None
+
+    # Set on the scratch engines of compileGroup(shareResults=True).
+    _shared = None
+
+    #: Set to true to remove the source text from compiled expressions
+    #: that support it (see :class:`SourceText`), saving memory.
+    dropSourceText = False
+
+    #: Whether the source text dropped with :attr:`dropSourceText` is
+    #: kept in an external table, for debugging and error messages.
+    keepDroppedSource = True
+
     def __init__(self):
         self.types = {}
         self.base_names = {}
         self.namespaces = {}
         self.iteratorFactory = Iterator
+        self._cache = {}
+        self._bundle = None
+        self._recorder = None
+        # Guards registrations and compilations in progress, which map
+        # the expression to an event set once it is in the cache.
+        self._lock = threading.Lock()
+        self._compiling = {}
+        self._generation = 0
+        self._pool = threading.local()
+        self._tiered = {}
+        self._promotions = 0
+        self._compileDepth = threading.local()
+        self._sharedTuples = {}
+        # The results of the cached: expressions compiled by this
+        # engine, by their text (and key).
+        self.resultCache = ResultCache()
 
     def registerFunctionNamespace(self, namespacename, namespacecallable):
         """
@@ -595,7 +796,13 @@ class ExpressionEngine:
 
             engine.registerFunctionNamespace('string', stringFuncs)
         """
-        self.namespaces[namespacename] = namespacecallable
+        with self._lock:
+            # Registries are copied on write, so that readers in other
+            # threads never see them change while they use them.
+            namespaces = dict(self.namespaces)
+            namespaces[namespacename] = namespacecallable
+            self.namespaces = namespaces
+            self._configurationChanged()
 
     def getFunctionNamespace(self, namespacename):
         """ Returns the function namespace """
@@ -611,11 +818,16 @@ class ExpressionEngine:
         if not _valid_name(name):
             raise RegistrationError(
                 'Invalid expression type name "%s".' % name)
-        types = self.types
-        if name in types:
-            raise RegistrationError(
-                'Multiple registrations for Expression type "%s".' % name)
-        types[name] = handler
+        with self._lock:
+            types = self.types
+            if name in types:
+                raise RegistrationError(
+                    'Multiple registrations for Expression type "%s".'
+                    % name)
+            types = dict(types)
+            types[name] = handler
+            self.types = types
+            self._configurationChanged()
 
     def getTypes(self):
         return self.types
@@ -623,16 +835,216 @@ class ExpressionEngine:
     def registerBaseName(self, name, object):
         if not _valid_name(name):
             raise RegistrationError('Invalid base name "%s".' % name)
-        base_names = self.base_names
-        if name in base_names:
-            raise RegistrationError(
-                'Multiple registrations for base name "%s".' % name)
-        base_names[name] = object
+        with self._lock:
+            base_names = self.base_names
+            if name in base_names:
+                raise RegistrationError(
+                    'Multiple registrations for base name "%s".' % name)
+            base_names = dict(base_names)
+            base_names[name] = object
+            self.base_names = base_names
 
     def getBaseNames(self):
         return self.base_names
 
     def compile(self, expression):
+        """
+        Compile *expression* with the handler registered for its type.
+
+        If :attr:`compileCacheSize` is set, compiled expressions are
+        cached by their text, so compiling the same expression again
+        usually returns the same object: callers must not modify it,
+        and the state kept by expressions (like the statistics of
+        adaptive path expressions or the count of tiered expressions)
+        covers all of its uses.  The cache holds the
+        :attr:`compileCacheSize` most recently compiled expressions and
+        is cleared whenever the configuration of the engine changes.
+        :meth:`Context.evaluate` and the other methods of contexts
+        compile the strings they are given, so this also saves
+        compiling them for each evaluation.
+
+        This is safe to call from several threads: if they compile the
+        same expression at the same time while the cache is enabled,
+        one of them compiles it and the others wait for its result.
+
+        If :attr:`tierThreshold` is set, the result is a
+        :class:`TieredExpression` wrapping the compiled expression
+        (the sub-expressions it compiles are not wrapped).
+        """
+        threshold = self.tierThreshold
+        if threshold is None and self._shared is None:
+            return self._compileShared(expression)
+        local = self._compileDepth
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        try:
+            compiled = self._compileShared(expression)
+        finally:
+            local.depth = depth
+        if depth:
+            if self._shared is not None:
+                shared = self._shared.get(expression)
+                if shared is None or shared.expression is not compiled:
+                    shared = self._shared.setdefault(
+                        expression, SharedExpression(compiled))
+                return shared
+            return compiled
+        if threshold is None:
+            return compiled
+        tiered = self._tiered.get(expression)
+        if tiered is None or tiered.expression is not compiled:
+            tiered = TieredExpression(compiled, threshold, self._promoted)
+            with self._lock:
+                tiered = self._tiered.setdefault(expression, tiered)
+                self._evict(self._tiered)
+        return tiered
+
+    def _evict(self, cache):
+        # Drop the oldest entries beyond the size limit; called with
+        # the lock held.  Cache hits do not reorder entries (as an LRU
+        # would), so that the threads evaluating expressions only read
+        # the cache.
+        size = self.compileCacheSize
+        if size is not None:
+            while len(cache) > size:
+                del cache[next(iter(cache))]
+
+    def _promoted(self, tiered):
+        with self._lock:
+            self._promotions += 1
+        if self.onPromotion is not None:
+            self.onPromotion(tiered)
+
+    def getTierStats(self):
+        """
+        Return a mapping with the number of tiered ``expressions`` and
+        the number of them that were ``promoted``.
+        """
+        return {'expressions': len(self._tiered),
+                'promoted': self._promotions}
+
+    def _compileShared(self, expression):
+        compiled = self._cache.get(expression)
+        if compiled is not None:
+            return compiled
+        thread = threading.get_ident()
+        with self._lock:
+            try:
+                return self._cache[expression]
+            except KeyError:
+                pass
+            generation = self._generation
+            compiling = self._compiling.get(expression)
+            if compiling is None:
+                self._compiling[expression] = (threading.Event(), thread)
+        if compiling is not None:
+            done, owner = compiling
+            if owner != thread:
+                done.wait()
+                try:
+                    return self._cache[expression]
+                except KeyError:
+                    # The compilation failed; fail on our own.
+                    pass
+            return self._compile(expression)
+        try:
+            compiled = self._compile(expression)
+            if self.dropSourceText:
+                self._dropSource(compiled)
+            with self._lock:
+                if self._generation == generation:
+                    self._cache[expression] = compiled
+                    self._evict(self._cache)
+        finally:
+            with self._lock:
+                done, owner = self._compiling.pop(expression)
+            done.set()
+        return compiled
+
+    def _shareTuple(self, items):
+        # Return a tuple equal to *items*, shared by the expressions
+        # compiled by this engine (see memoryReport()).
+        items = tuple(items)
+        table = self._sharedTuples
+        shared = table.get(items)
+        if shared is None:
+            size = self.compileCacheSize
+            # Compiled expressions use a few tuples each.  Sharing only
+            # saves memory, so start over rather than keeping the tuples
+            # of evicted expressions alive.
+            if size is not None and len(table) >= 4 * size:
+                self._sharedTuples = table = {}
+            shared = table.setdefault(items, items)
+        return shared
+
+    def _dropSource(self, compiled):
+        if not isinstance(getattr(type(compiled), '_s', None), SourceText):
+            return
+        text = compiled.__dict__.pop('_s', None)
+        if text is not None and self.keepDroppedSource:
+            _droppedSources[compiled] = text
+
+    def memoryReport(self):
+        """
+        Return a mapping describing the memory used by the compiled
+        expressions in the cache.
+
+        This has the number of cached ``expressions``, the number of
+        distinct ``objects`` of each type they are made of (including
+        sub-expressions) and the approximate number of ``bytes`` used
+        by them, their attributes and the strings and tuples these
+        refer to, counting shared objects once.  ``sourceBytes`` is the
+        part of it used by source texts.
+        """
+        seen = set()
+        objects = {}
+        pending = list(self._cache.values())
+        total = source = 0
+
+        def size(value):
+            # The size of plain data, queueing the expressions found.
+            if id(value) in seen:
+                return 0
+            if (ITALESExpression.providedBy(value)
+                    or hasattr(value, 'subexpressions')):
+                pending.append(value)
+                return 0
+            if getattr(value, '__func__', None) is not None:
+                # The bound methods of sub-path expressions.
+                pending.append(value.__self__)
+            elif not isinstance(value, (str, bytes, int, float, tuple,
+                                        list, frozenset, CodeType)):
+                # Shared machinery, like engines and traversers.
+                return 0
+            seen.add(id(value))
+            n = sys.getsizeof(value)
+            if isinstance(value, (tuple, list, frozenset)):
+                n += sum(size(item) for item in value)
+            return n
+
+        while pending:
+            ob = pending.pop()
+            if id(ob) in seen:
+                continue
+            seen.add(id(ob))
+            name = type(ob).__name__
+            objects[name] = objects.get(name, 0) + 1
+            total += sys.getsizeof(ob)
+            d = getattr(ob, '__dict__', None)
+            if d is None:
+                continue
+            total += sys.getsizeof(d)
+            for key, value in list(d.items()):
+                n = size(value)
+                total += n
+                if key in ('_s', 'text'):
+                    source += n
+        return {'expressions': len(self._cache),
+                'objects': objects,
+                'bytes': total,
+                'sourceBytes': source}
+
+    def _compile(self, expression):
         m = _parse_expr(expression)
         if m:
             type = m.group(1)
@@ -646,6 +1058,176 @@ class ExpressionEngine:
             raise CompilerError('Unrecognized expression type "%s".' % type)
         return handler(type, expr, self)
 
+    def warmup(self, expressions, freeze=False):
+        """
+        Compile *expressions* into the compile cache.
+
+        This is meant to be called in a preforking server before the
+        workers are forked, so that they share the compiled expressions
+        instead of each compiling their own copy.  If *freeze* is true
+        and the Python implementation supports it, :func:`gc.freeze` is
+        called afterwards, moving all objects to a permanent generation
+        that the garbage collector of the workers never touches (and
+        thus never copies).  Only the last :attr:`compileCacheSize`
+        expressions stay in the cache.
+
+        Returns the number of expressions compiled.
+
+        :raises ValueError: If the compile cache is disabled.
+        """
+        if self.compileCacheSize == 0:
+            raise ValueError(
+                'warmup needs the compile cache, see compileCacheSize')
+        count = 0
+        for expression in expressions:
+            self.compile(expression)
+            count += 1
+        if freeze and hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+        return count
+
+    def _configurationChanged(self):
+        self._generation += 1
+        self._cache = {}
+        self._tiered = {}
+        self._sharedTuples = {}
+        self.resultCache.clear()
+        bundle = self._bundle
+        if bundle is not None and bundle.fingerprint != self.getFingerprint():
+            self._bundle = None
+            bundle.close()
+
+    def getFingerprint(self):
+        """
+        Return a string identifying the configuration of this engine.
+
+        Precompiled bundles are only used by engines with the same
+        fingerprint as the engine that produced them.
+        """
+        h = hashlib.sha256(_BUNDLE_MAGIC + MAGIC_NUMBER)
+        for name, handler in sorted(self.types.items()):
+            h.update(('%s=%s.%s;' % (
+                name, handler.__module__,
+                getattr(handler, '__qualname__', type(handler).__qualname__),
+            )).encode('utf-8'))
+        return h.hexdigest()
+
+    def compilePythonCode(self, text, compiler):
+        """
+        Return the code object for the Python expression *text*.
+
+        If a precompiled bundle is loaded and contains *text*, the code
+        is taken from the bundle.  Otherwise ``compiler(text, filename)``
+        is called to compile it.  Python expression types call this
+        instead of compiling directly so that bundles can be used.
+        """
+        bundle = self._bundle
+        if bundle is not None:
+            code = bundle.get(text)
+            if code is not None:
+                return code
+        code = compiler(text, '<string>')
+        if self._recorder is not None:
+            self._recorder[text] = code
+        return code
+
+    def dumpBundle(self, filename, expressions):
+        """
+        Precompile *expressions* into a bundle file named *filename*.
+
+        The bundle holds the marshalled code of every Python expression
+        used (directly or nested) by *expressions*, along with the
+        fingerprint of this engine.  It can be loaded with
+        :meth:`loadBundle` by engines with the same configuration.
+        """
+        # Compile with a scratch copy so every Python expression is
+        # compiled (and recorded) afresh, without touching our cache.
+        scratch = self._scratch()
+        scratch._bundle = None
+        scratch._recorder = codes = {}
+        for expression in expressions:
+            scratch.compile(expression)
+
+        index = {}
+        records = []
+        offset = 0
+        for text, code in codes.items():
+            record = marshal.dumps(code)
+            index[text] = (offset, len(record))
+            records.append(record)
+            offset += len(record)
+        header = marshal.dumps((self.getFingerprint(), index))
+        with open(filename, 'wb') as f:
+            f.write(_BUNDLE_MAGIC)
+            f.write(_BUNDLE_HEADER.pack(len(header)))
+            f.write(header)
+            for record in records:
+                f.write(record)
+        return len(index)
+
+    def _scratch(self):
+        # Return a copy of this engine with its own caches, enabled so
+        # that the expressions compiled with it share sub-expressions.
+        scratch = copy.copy(self)
+        scratch.compileCacheSize = None
+        scratch._cache = {}
+        scratch._lock = threading.Lock()
+        scratch._compiling = {}
+        scratch._tiered = {}
+        scratch._compileDepth = threading.local()
+        return scratch
+
+    def compileGroup(self, expressions, shareResults=False):
+        """
+        Compile *expressions*, the expressions of a template, and return
+        an :class:`ExpressionGroup` of the results.
+
+        Identical sub-expressions are compiled once and shared (whether
+        or not :attr:`compileCacheSize` is set, as the expressions are
+        compiled with a cache of their own).  If *shareResults* is
+        true, shared sub-expressions are evaluated with
+        :meth:`Context.evaluate`: contexts tracking dependencies (see
+        :meth:`Context.setTracking`) then compute each of them once
+        until the variables it reads change.
+        """
+        engine = self._scratch()
+        if shareResults:
+            engine._shared = {}
+        return ExpressionGroup(
+            [engine.compile(expression) for expression in expressions])
+
+    def loadBundle(self, filename):
+        """
+        Memory-map the bundle *filename* written by :meth:`dumpBundle`.
+
+        Code objects are only unmarshalled when an expression using them
+        is first compiled.  Returns `False` (and ignores the bundle) if it
+        was produced by an engine with a different fingerprint.
+        """
+        bundle = _Bundle(filename)
+        if bundle.fingerprint != self.getFingerprint():
+            bundle.close()
+            return False
+        with self._lock:
+            old, self._bundle = self._bundle, bundle
+            self._generation += 1
+            self._cache = {}
+        if old is not None:
+            old.close()
+        return True
+
+    def optimize(self, expression, passes=None):
+        """
+        Return an :class:`~zope.tales.ir.OptimizedExpression` evaluating
+        *expression* (compiled first if it is a string) through its
+        intermediate representation, optimized by *passes* (a
+        :class:`~zope.tales.ir.PassManager`).
+        """
+        if isinstance(expression, str):
+            expression = self.compile(expression)
+        return OptimizedExpression(expression, passes)
+
     def getContext(self, contexts=None, **kwcontexts):
         """
         Return a new expression engine.
@@ -664,10 +1246,207 @@ class ExpressionEngine:
                 kwcontexts = contexts
         return Context(self, kwcontexts)
 
+    def getPooledContext(self, contexts=None, **kwcontexts):
+        """
+        Like :meth:`getContext`, but reuse a context given back to
+        :meth:`releaseContext` by the current thread, if there is one.
+        """
+        pool = getattr(self._pool, 'contexts', None)
+        if not pool:
+            return self.getContext(contexts, **kwcontexts)
+        if contexts is not None:
+            if kwcontexts:
+                kwcontexts.update(contexts)
+            else:
+                kwcontexts = contexts
+        context = pool.pop()
+        context.reset(kwcontexts)
+        return context
+
+    def releaseContext(self, context):
+        """
+        Give *context* back for reuse by :meth:`getPooledContext` in the
+        current thread.
+
+        The context is reset, dropping the variables of the render it
+        was used for.  At most :attr:`contextPoolSize` contexts are kept
+        per thread; the context must not be used after this call.
+        """
+        try:
+            pool = self._pool.contexts
+        except AttributeError:
+            pool = self._pool.contexts = []
+        if len(pool) < self.contextPoolSize:
+            context.reset({})
+            pool.append(context)
+
     def getCompilerError(self):
         return CompilerError
 
 
+@implementer(ITALESExpression)
+class TieredExpression:
+    """
+    A compiled *expression* counting its evaluations, replaced by a
+    specialized version (see :func:`zope.tales.ir.specialize`) once
+    their ``count`` reaches *threshold*.
+
+    The count is not synchronized: threads evaluating the expression
+    at the same time may lose increments (on free-threaded builds), so
+    it is a lower bound, which may delay the promotion a little.
+
+    *onPromotion* is called with this object when that happens.
+    Other attributes are those of the wrapped expression.
+    """
+
+    def __init__(self, expression, threshold, onPromotion=None):
+        self.expression = expression
+        self.threshold = threshold
+        self.count = 0
+        self.tier = 0
+        self._call = expression
+        self._onPromotion = onPromotion
+
+    def __call__(self, econtext):
+        self.count += 1
+        if not self.tier and self.count >= self.threshold:
+            self.promote()
+        return self._call(econtext)
+
+    def promote(self):
+        """Switch to the specialized version now."""
+        with _promotionLock:
+            if self.tier:
+                return
+            self._call = specialize(self.expression)
+            self.tier = 1
+        if self._onPromotion is not None:
+            self._onPromotion(self)
+
+    def toIR(self):
+        return toIR(self.expression)
+
+    def __getattr__(self, name):
+        if name == 'expression' or name[:2] == name[-2:] == '__':
+            # Not initialized (yet), e.g. while being copied, or a
+            # special method this class does not define.
+            raise AttributeError(name)
+        return getattr(self.expression, name)
+
+    def __repr__(self):
+        return '<TieredExpression %r tier %d>' % (self.expression, self.tier)
+
+
+_promotionLock = threading.Lock()
+
+
+@implementer(ITALESExpression)
+class SharedExpression:
+    """
+    A compiled *expression* shared by the expressions of a group (see
+    :meth:`ExpressionEngine.compileGroup`), evaluated through the
+    memoization of contexts tracking dependencies.
+
+    Other attributes are those of the wrapped expression.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+
+    def __call__(self, econtext):
+        if getattr(econtext, '_memo', None) is None:
+            return self.expression(econtext)
+        return econtext.evaluate(self.expression)
+
+    def __getattr__(self, name):
+        if name == 'expression' or name[:2] == name[-2:] == '__':
+            # Not initialized (yet), e.g. while being copied, or a
+            # special method this class does not define.
+            raise AttributeError(name)
+        return getattr(self.expression, name)
+
+    def __repr__(self):
+        return '<SharedExpression %r>' % (self.expression,)
+
+
+class ExpressionGroup:
+    """
+    The sequence of compiled expressions returned by
+    :meth:`ExpressionEngine.compileGroup`.
+    """
+
+    def __init__(self, expressions):
+        self.expressions = tuple(expressions)
+
+    def __len__(self):
+        return len(self.expressions)
+
+    def __getitem__(self, i):
+        return self.expressions[i]
+
+    def __iter__(self):
+        return iter(self.expressions)
+
+    def getStats(self):
+        """
+        Return a mapping with the number of expressions and
+        sub-expressions the group is made of (``requested``) and the
+        number of distinct objects compiled for them (``unique``).
+        """
+        requested = 0
+        unique = set()
+        pending = list(self.expressions)
+        while pending:
+            expression = pending.pop()
+            while isinstance(expression, (TieredExpression,
+                                          SharedExpression)):
+                expression = expression.expression
+            requested += 1
+            if id(expression) in unique:
+                continue
+            unique.add(id(expression))
+            subexpressions = getattr(expression, 'subexpressions', None)
+            if subexpressions is not None:
+                pending.extend(subexpressions())
+        return {'requested': requested, 'unique': len(unique)}
+
+
+class _Bundle:
+    """A memory-mapped bundle of precompiled Python code."""
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = memoryview(self._map)
+        size = len(_BUNDLE_MAGIC)
+        if bytes(data[:size]) != _BUNDLE_MAGIC:
+            data.release()
+            self._map.close()
+            raise ValueError('%r is not an expression bundle' % filename)
+        length, = _BUNDLE_HEADER.unpack_from(data, size)
+        start = size + _BUNDLE_HEADER.size
+        self.fingerprint, self._index = marshal.loads(
+            data[start:start + length])
+        self._start = start + length
+        data.release()
+
+    def get(self, text):
+        try:
+            offset, length = self._index[text]
+        except KeyError:
+            return None
+        offset += self._start
+        return marshal.loads(self._map[offset:offset + length])
+
+    def close(self):
+        self._map.close()
+
+
+# The instance attributes overriding class defaults that reset() drops.
+_resetNames = ('position', 'source_file', '_memo', '_dependents', '_budget',
+               '_invariants')
+
+
 @implementer(ITALExpressionEngine)
 class Context:
     """
@@ -680,6 +1459,8 @@ class Context:
     """
     position = (None, None)
     source_file = None
+    # The number of times reset() was called.
+    _renders = 0
 
     def __init__(self, engine, contexts):
         """
@@ -689,20 +1470,41 @@ class Context:
             variable scope.
         """
         self._engine = engine
+        self.repeat_vars = {}
+        self._vars_stack = []
+        # Keep track of what needs to be popped as each scope ends.
+        self._scope_stack = []
+        self.reset(contexts)
+
+    def reset(self, contexts):
+        """
+        Reinitialize this object in place, as if it had just been
+        created for *contexts*, so that it can be reused.  Repeat
+        iterators and ``defer:`` wrappers created before raise a
+        :class:`TALESError` if they are used afterwards.
+
+        Subclasses keeping more state should extend this.
+        """
+        self._renders += 1
         self.contexts = contexts
         self.setContext('nothing', None)
         self.setContext('default', _default)
 
-        self.repeat_vars = rv = {}
+        rv = self.repeat_vars
+        rv.clear()
         # Wrap this, as it is visible to restricted code
         self.setContext('repeat', rv)
         self.setContext('loop', rv)  # alias
 
         self.vars = vars = contexts.copy()
-        self._vars_stack = [vars]
-
-        # Keep track of what needs to be popped as each scope ends.
-        self._scope_stack = []
+        self._vars_stack[:] = [vars]
+        del self._scope_stack[:]
+        # Forget the position, dependency tracking, budget and
+        # invariants of the previous render.
+        d = self.__dict__
+        for name in _resetNames:
+            if name in d:
+                del d[name]
 
     def setContext(self, name, value):
         """Hook to allow subclasses to do things like adding security proxies.
@@ -715,8 +1517,14 @@ class Context:
         self._scope_stack.append([])
 
     def endScope(self):
-        self._vars_stack.pop()
-        self.vars = self._vars_stack[-1]
+        popped = self._vars_stack.pop()
+        self.vars = vars = self._vars_stack[-1]
+        if self._invariants is not None:
+            self._invariants.pop(len(self._vars_stack), None)
+        if self._memo is not None:
+            for name, value in popped.items():
+                if vars.get(name, _marker) is not value:
+                    self.invalidate(name)
 
         scope = self._scope_stack.pop()
         # Pop repeat variables, if any
@@ -731,10 +1539,123 @@ class Context:
 
     def setLocal(self, name, value):
         self.vars[name] = value
+        _stored(self, value)
+        if self._memo is not None:
+            self.invalidate(name)
 
     def setGlobal(self, name, value):
         for vars in self._vars_stack:
             vars[name] = value
+        _stored(self, value)
+        if self._memo is not None:
+            self.invalidate(name)
+
+    #: Names whose values change without :meth:`setLocal` or
+    #: :meth:`setGlobal`; expressions reading them are never memoized.
+    volatileNames = frozenset(['repeat', 'loop', 'CONTEXTS'])
+
+    _memo = None
+
+    def setTracking(self, enabled=True):
+        """
+        Turn dependency tracking on or off.
+
+        While tracking, :meth:`evaluate` memoizes the result of each
+        expression that can tell its ``dependencies()``, until one of
+        the variables they read is set again with :meth:`setLocal` or
+        :meth:`setGlobal` or goes out of scope.  Variables changed in
+        place must be reported with :meth:`invalidate`.  Results are
+        memoized by compiled expression, so evaluating the same string
+        again only uses them if the engine caches compiled expressions
+        (see :attr:`~ExpressionEngine.compileCacheSize`).
+        """
+        if not enabled:
+            self.__dict__.pop('_memo', None)
+            self.__dict__.pop('_dependents', None)
+        elif self._memo is None:
+            self._memo = {}
+            # Maps variable names to the memoized expressions reading them.
+            self._dependents = {}
+
+    def invalidate(self, name):
+        """
+        Forget the memoized results of the expressions reading the
+        variable *name* (see :meth:`setTracking`).
+        """
+        memo = self._memo
+        if memo is not None:
+            for expression in self._dependents.pop(name, ()):
+                memo.pop(expression, None)
+
+    # Maps scope levels to the results of invariant expressions.
+    _invariants = None
+
+    def evaluateInvariant(self, expression, loopNames=None):
+        """
+        Evaluate *expression* like :meth:`evaluate`, remembering the
+        result for the outermost scope in which the variables it reads
+        have their current values, if it is invariant in the loops
+        defining *loopNames* (by default, the active repeat variables).
+
+        The result is reused as long as these variables keep (are bound
+        to the same objects as) these values, so a template compiler can
+        hoist loop-invariant expressions out of ``tal:repeat`` loops.
+        Unlike :func:`isLoopInvariant`, this follows the variables read
+        by deferred expressions.
+        """
+        if isinstance(expression, str):
+            expression = self._engine.compile(expression)
+        if loopNames is None:
+            loopNames = self.repeat_vars
+        names = self._trackedNames(expression)
+        if names is None or not names.isdisjoint(loopNames):
+            return self.evaluate(expression)
+        names = tuple(sorted(names))
+        vars = self.vars
+        values = tuple(vars.get(name, _marker) for name in names)
+        invariants = self._invariants
+        if invariants is None:
+            invariants = self._invariants = {}
+        stack = self._vars_stack
+        for level in range(len(stack) - 1, -1, -1):
+            entry = invariants.get(level, {}).get(expression)
+            if entry is not None and entry[0] == names and all(
+                    a is b for a, b in zip(entry[1], values)):
+                return entry[2]
+        result = self.evaluate(expression)
+        for level, scope in enumerate(stack):
+            if all(scope.get(name, _marker) is value
+                   for name, value in zip(names, values)):
+                break
+        invariants.setdefault(level, {})[expression] = (
+            names, values, result)
+        return result
+
+    def _trackedNames(self, expression):
+        # Return the variables read by *expression*, including those
+        # read by the deferred expressions it uses, or None if it must
+        # not be memoized.
+        dependencies = getattr(expression, 'dependencies', None)
+        dependencies = dependencies() if dependencies is not None else None
+        if dependencies is None:
+            return None
+        names = set()
+        pending = list(dependencies)
+        while pending:
+            name = pending.pop()[0]
+            if name in names:
+                continue
+            if name in self.volatileNames:
+                return None
+            names.add(name)
+            # Deferred expressions tell what they read.
+            dependencies = getattr(self.vars.get(name), 'dependencies', None)
+            if dependencies is not None:
+                dependencies = dependencies()
+                if dependencies is None:
+                    return None
+                pending.extend(dependencies)
+        return names
 
     def getValue(self, name, default=None):
         """return the current value of variable *name* or *default*."""
@@ -748,7 +1669,30 @@ class Context:
         # (no need to iterate over ``_vars_stack``).
         return self.vars.get(name, default)
 
+    _budget = None
+
+    def setBudget(self, seconds=None, steps=None):
+        """
+        Limit the evaluations made with this context to a wall-clock
+        time of *seconds* from now and/or to a number of *steps*, or
+        remove the limits if neither is given.
+
+        Each call of :meth:`evaluate` and :meth:`setRepeat` and each
+        iteration of a repeat counts as a step; when a limit is
+        exceeded :exc:`BudgetExceeded` is raised.  The sub-expressions
+        of an evaluated expression (like the paths interpolated in a
+        ``string:`` expression) are not counted separately, and Python
+        expressions are not interrupted while they run.
+        """
+        if seconds is None and steps is None:
+            self.__dict__.pop('_budget', None)
+        else:
+            self._budget = _Budget(seconds, steps)
+
     def setRepeat(self, name, expr):
+        budget = self._budget
+        if budget is not None:
+            budget.step()
         expr = self.evaluate(expr)
         if not expr:
             return self._engine.iteratorFactory(name, (), self)
@@ -756,6 +1700,7 @@ class Context:
         old_value = self.repeat_vars.get(name)
         self._scope_stack[-1].append((name, old_value))
         self.repeat_vars[name] = it
+        _stored(self, it)
         return it
 
     def evaluate(self, expression):
@@ -769,10 +1714,96 @@ class Context:
             expression = self._engine.compile(expression)
         __traceback_supplement__ = (
             TALESTracebackSupplement, self, expression)
-        return expression(self)
+        budget = self._budget
+        if budget is not None:
+            budget.step()
+        memo = self._memo
+        if memo is None:
+            return expression(self)
+        try:
+            return memo[expression]
+        except (KeyError, TypeError):
+            pass
+        result = expression(self)
+        names = self._trackedNames(expression)
+        if names is not None:
+            memo[expression] = result
+            dependents = self._dependents
+            for name in names:
+                dependents.setdefault(name, set()).add(expression)
+        return result
 
     evaluateValue = evaluate
 
+    def evaluateInto(self, expression, writer):
+        """
+        Evaluate *expression* and write its text to *writer*, which is
+        either a callable or a list that the text is appended to.
+
+        Expressions with an ``evaluateInto(econtext, write)`` method
+        (like ``string:`` expressions) write their text in pieces,
+        without building an intermediate string.  For other expressions
+        the result of :meth:`evaluateText` is written, unless it is
+        `None` or the default marker, which are returned instead
+        (without writing anything).
+        """
+        if isinstance(expression, str):
+            expression = self._engine.compile(expression)
+        write = writer.append if isinstance(writer, list) else writer
+        into = None
+        if self._memo is None:
+            into = getattr(expression, 'evaluateInto', None)
+        if into is not None:
+            __traceback_supplement__ = (
+                TALESTracebackSupplement, self, expression)
+            into(self, write)
+            return None
+        text = self.evaluateText(expression)
+        if text is None or text is self.getDefault():
+            return text
+        write(text)
+        return None
+
+    def dependencyKey(self, expression):
+        """
+        Return a key identifying the current values of what *expression*
+        reads, or `None` if it cannot be computed.
+
+        The key is a tuple of ``(path, value)`` pairs for the paths
+        returned by the ``dependencies()`` method of *expression*,
+        resolved as ``nocall:`` path expressions; undefined paths have
+        the value :data:`UNDEFINED`.  It is `None` if *expression* has
+        no known dependencies.  Rendered fragments can be cached by this
+        key.
+
+        Values that are not hashable (like lists or dictionaries) are
+        compared by identity: the key changes when a path resolves to
+        another object, but not when the object is changed in place
+        (as with :meth:`setTracking`).
+        """
+        if isinstance(expression, str):
+            expression = self._engine.compile(expression)
+        dependencies = getattr(expression, 'dependencies', None)
+        if dependencies is None:
+            return None
+        dependencies = dependencies()
+        if dependencies is None:
+            return None
+        key = []
+        for path in sorted(dependencies):
+            try:
+                value = self._engine.compile(
+                    'nocall:' + '/'.join(path))(self)
+            except (Undefined, AttributeError, LookupError, TypeError):
+                value = UNDEFINED
+            else:
+                try:
+                    hash(value)
+                except TypeError:
+                    value = _Identity(value)
+            key.append((path, value))
+        return tuple(key)
+
     def evaluateBoolean(self, expr):
         """
         Evaluate the expression and return the boolean value of its result.
@@ -808,11 +1839,223 @@ class Context:
     def setPosition(self, position):
         self.position = position
 
+    #: A :class:`TranslationCache` used by :meth:`translate` and
+    #: :meth:`translateMany`, or `None` not to cache translations.
+    translationCache = None
+
     def translate(self, msgid, domain=None, mapping=None, default=None):
+        """
+        Translate *msgid* with :meth:`translateMessage`.
+
+        If a :attr:`translationCache` is set, translations without a
+        *mapping* are looked up in it first.
+        """
+        cache = self.translationCache
+        if cache is not None and not mapping:
+            key = self._translationKey(msgid, domain, default)
+            if key is not None:
+                result = cache.get(key, _marker)
+                if result is _marker:
+                    result = self.translateMessage(
+                        msgid, domain, mapping, default)
+                    cache.set(key, result)
+                return result
+        return self.translateMessage(msgid, domain, mapping, default)
+
+    def translateMany(self, msgids, domain=None):
+        """
+        Translate the sequence *msgids*, returning a list.
+
+        The messages not found in the :attr:`translationCache` are
+        translated with a single call of :meth:`translateMessages`.
+        """
+        cache = self.translationCache
+        results = [None] * len(msgids)
+        missing = []
+        keys = []
+        for i, msgid in enumerate(msgids):
+            key = None
+            if cache is not None:
+                key = self._translationKey(msgid, domain, None)
+            if key is not None:
+                result = cache.get(key, _marker)
+                if result is not _marker:
+                    results[i] = result
+                    continue
+            missing.append(i)
+            keys.append(key)
+        if missing:
+            translated = self.translateMessages(
+                [msgids[i] for i in missing], domain)
+            for i, key, result in zip(missing, keys, translated):
+                results[i] = result
+                if key is not None:
+                    cache.set(key, result)
+        return results
+
+    def translateMessage(self, msgid, domain=None, mapping=None,
+                         default=None):
+        """
+        Actually translate *msgid*, bypassing the translation cache.
+        """
         # custom Context implementations are supposed to customize
         # this to call whichever translation routine they want to use
         return str(msgid)
 
+    def translateMessages(self, msgids, domain=None):
+        """
+        Actually translate the list *msgids*, returning a list.
+
+        Catalog backends able to translate many messages at once can
+        override this; by default :meth:`translateMessage` is called for
+        each of them.
+        """
+        return [self.translateMessage(msgid, domain) for msgid in msgids]
+
+    def getLanguage(self):
+        """
+        Return the language translations are made to, which is part of
+        the keys of the translation cache.
+        """
+        return None
+
+    def _translationKey(self, msgid, domain, default):
+        # Messages (like zope.i18nmessageid's) carry their own domain,
+        # default and mapping; those with a mapping are not cached.
+        if getattr(msgid, 'mapping', None):
+            return None
+        key = (str(msgid), domain, default, self.getLanguage(),
+               getattr(msgid, 'domain', None), getattr(msgid, 'default', None))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+
+class _Budget:
+    """The evaluation limits set by :meth:`Context.setBudget`."""
+
+    __slots__ = ('deadline', 'steps', 'countdown')
+
+    # The deadline is checked on the first step and then every that
+    # many steps, so that most steps only decrement a counter.
+    CLOCK_INTERVAL = 64
+
+    def __init__(self, seconds, steps):
+        self.deadline = None if seconds is None else (
+            time.monotonic() + seconds)
+        # The steps left besides those of the countdown.
+        self.steps = steps
+        self.countdown = 0
+
+    def step(self):
+        self.countdown -= 1
+        if self.countdown < 0:
+            self._check()
+
+    def _check(self):
+        steps = self.steps
+        if steps is not None and steps <= 0:
+            raise BudgetExceeded('Evaluation step budget exceeded')
+        deadline = self.deadline
+        if deadline is not None and time.monotonic() > deadline:
+            raise BudgetExceeded('Evaluation deadline exceeded')
+        n = self.CLOCK_INTERVAL if deadline is not None else sys.maxsize
+        if steps is not None:
+            n = min(n, steps)
+            self.steps = steps - n
+        # This step is the first of the n.
+        self.countdown = n - 1
+
+
+class TranslationCache:
+    """
+    A thread-safe cache of translations, evicting the least recently
+    used ones beyond *maxsize* entries.
+
+    Set an instance as the :attr:`~Context.translationCache` of a
+    :class:`Context` class to share it between all of its instances.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            data = self._data
+            data[key] = value
+            data.move_to_end(key)
+            if len(data) > self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def getStats(self):
+        """
+        Return a mapping with the number of ``hits``, ``misses`` and
+        ``evictions``, the ``hitRate`` and the current ``size``.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hitRate': self.hits / lookups if lookups else 0.0,
+                    'size': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache(TranslationCache):
+    """
+    A :class:`TranslationCache` of expression results expiring after a
+    time to live, measured with *clock*.
+
+    Each engine has one, its :attr:`~ExpressionEngine.resultCache`.
+    """
+
+    def __init__(self, maxsize=1024, clock=time.monotonic):
+        TranslationCache.__init__(self, maxsize)
+        self._clock = clock
+
+    def get(self, key, default=None):
+        with self._lock:
+            data = self._data
+            entry = data.get(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl):
+        TranslationCache.set(self, key, (self._clock() + ttl, value))
+
 
 class TALESTracebackSupplement:
     """Implementation of zope.exceptions.ITracebackSupplement"""
@@ -181,6 +181,47 @@ class TestParsedExpressions(ExpressionTestBase):
         expr = self.engine.compile('x/y/?dynamic')
         self._check_evals_to(expr, self.context.vars['x'].y.z)
 
+    def testIndex(self):
+        self.context.vars['items'] = [Data(title='first'), ('a', 'b')]
+        self.context.vars['mapping'] = {'0': 'zero', '10': {'1': 'one'}}
+        expr = self._check_evals_to('items/0/title', 'first')
+        self.assertEqual(expr._subexprs[0].__self__._compiled_path,
+                         ((), 0, ('title',)))
+        self._check_evals_to('items/1/1', 'b')
+        self._check_evals_to('mapping/0', 'zero')
+        self._check_evals_to('mapping/10/1', 'one')
+        self._check_evals_to('items/2 | mapping/0', 'zero')
+        self._check_evals_to('exists:items/2', 0)
+        # Only canonical numbers are indexes
+        expr = self.engine.compile('mapping/01')
+        self.assertEqual(expr._subexprs[0].__self__._compiled_path,
+                         (('01',),))
+        self._check_raises_compiler_error('0/title', 'Invalid variable name')
+
+    def testIndexCustomTraverser(self):
+        from zope.tales.engine import DefaultEngine
+        from zope.tales.expressions import PathExpr
+
+        seen = []
+
+        def traverser(ob, path_items, econtext):
+            seen.append(tuple(path_items))
+            for name in path_items:
+                ob = ob[int(name)]
+            return ob
+
+        class MyPathExpr(PathExpr):
+            def __init__(self, name, expr, engine):
+                PathExpr.__init__(self, name, expr, engine, traverser)
+
+        self.engine = DefaultEngine()
+        self.engine.registerType('my', MyPathExpr)
+        self.context.vars['items'] = ['first']
+        expr = self._check_evals_to('my:items/0', 'first')
+        self.assertEqual(expr._subexprs[0].__self__._compiled_path,
+                         (('0',),))
+        self.assertEqual(seen, [('0',)])
+
     def testBadInitalDynamic(self):
         from zope.tales.tales import CompilerError
         with self.assertRaises(CompilerError) as exc:
@@ -264,6 +305,33 @@ class TestParsedExpressions(ExpressionTestBase):
             # raise UnicodeDecodeError
             self.context.vars['eightBits'].decode('ascii')
 
+    def testStringSegments(self):
+        from zope.tales.expressions import StringExpr
+        self.context.vars['z'] = ('a', 1)
+        for text, result in (
+                ('', ''),
+                ('$B', '2'),
+                ('${b}/${B}', 'boot/2'),
+                ('$B$b', '2boot'),
+                ('a${b}/${B}/$z%s', "aboot/2/('a', 1)%s"),
+                ('$B $B $B', '2 2 2'),
+        ):
+            expr = StringExpr('string', text, self.engine)
+            self.assertEqual(len(expr._segments), 2 * len(expr._vars) + 1)
+            self._check_evals_to(expr, result)
+
+    def testStringEvaluateInto(self):
+        expr = self.engine.compile('string:a ${x/y} $$ $B% c')
+        buf = []
+        expr.evaluateInto(self.context, buf.append)
+        self.assertEqual(buf, ['a ', 'yikes', ' $ ', '2', '% c'])
+        self.assertEqual(''.join(buf), expr(self.context))
+
+        buf = []
+        self.engine.compile('string:${b}').evaluateInto(
+            self.context, buf.append)
+        self.assertEqual(buf, ['boot'])
+
     def test_string_escape_percent(self):
         self._check_evals_to('string:%', '%')
 
@@ -366,6 +434,50 @@ class TestParsedExpressions(ExpressionTestBase):
         second_result = lazy()
         self.assertIs(first_result, second_result)
 
+    def test_lazy_wrapper_threads(self):
+        import threading
+
+        from zope.tales.expressions import LazyWrapper
+        barrier = threading.Barrier(4)
+
+        def expr(econtext):
+            barrier.wait()
+            return object()
+
+        lazy = LazyWrapper(expr, self.context)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(lazy()))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertIs(result, lazy())
+
+    def test_evaluate_threads(self):
+        import threading
+
+        from zope.tales.tales import Context
+        errors = []
+
+        def render(n):
+            context = Context(self.engine, {'n': n, 'x': self.context.vars})
+            for i in range(200):
+                result = context.evaluate(
+                    'string:${n}/${x/b} %d' % (i % 20))
+                if result != '%d/boot %d' % (n, i % 20):
+                    errors.append(result)
+
+        threads = [threading.Thread(target=render, args=(n,))
+                   for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
     def test_not(self):
         # self.context is a Data object, not a real
         # zope.tales.tales.Context object, and as such
@@ -379,6 +491,208 @@ class TestParsedExpressions(ExpressionTestBase):
         expr = self._check_evals_to('not:exists:v_42', 1)
         self.assertEqual("<NotExpr 'exists:v_42'>", repr(expr))
 
+    def test_not_fused(self):
+        calls = []
+
+        def evaluateBoolean(expr):
+            calls.append(expr)
+            return bool(expr(self.context))
+        self.context.evaluateBoolean = evaluateBoolean
+        expr = self._check_evals_to('not:not:b', 1)
+        self.assertEqual(calls, [expr._c])
+        self.assertEqual(repr(expr._c), "<PathExpr standard:'b'>")
+        self._check_evals_to('not:not:not:b', 0)
+        self._check_evals_to('not: not: not:x', 0)
+        del calls[:]
+        self._check_evals_to('not:exists:v_42', 1)
+        self._check_evals_to('not:not:exists:v_42', 0)
+        self._check_evals_to('not:defer:v_42', 0)
+        self._check_evals_to('not:not:lazy:v_42', 1)
+        self.assertEqual(calls, [])
+
+    def test_and(self):
+        self._check_evals_to('and: x, b', 'boot')
+        self._check_evals_to('and: python:0, v_42', 0)
+        expr = self._check_evals_to('and: B, python:max(B, 3), y/z', 3)
+        self.assertEqual("<AndExpr ' B, python:max(B, 3), y/z'>", repr(expr))
+
+    def test_or(self):
+        self._check_evals_to('or: python:"", python:0', 0)
+        self._check_evals_to('or: B, v_42', 2)
+        expr = self._check_evals_to('or: python:",", b', ',')
+        self.assertEqual("<OrExpr ' python:\",\", b'>", repr(expr))
+
+    def test_if(self):
+        self._check_evals_to('if: exists:x, b, v_42', 'boot')
+        self._check_evals_to('if: exists:v_42, v_42, string:no', 'no')
+        self._check_evals_to('if: python:0, v_42', None)
+        expr = self._check_evals_to('if: python:{"a": (1, 2)}, B', 2)
+        self.assertEqual("<IfExpr ' python:{\"a\": (1, 2)}, B'>", repr(expr))
+
+    def test_dependencies(self):
+        def deps(expr):
+            return self.engine.compile(expr).dependencies()
+        self.assertEqual(deps('x/y/z'), {('x', 'y', 'z')})
+        self.assertEqual(deps('x/items/0/name | b'),
+                         {('x', 'items', '0', 'name'), ('b',)})
+        self.assertEqual(deps('x/?dynamic/name'), {('x',), ('dynamic',)})
+        self.assertEqual(deps('CONTEXTS/x'), {('CONTEXTS', 'x')})
+        self.assertEqual(deps('string:${x/name} and $b'),
+                         {('x', 'name'), ('b',)})
+        self.assertEqual(deps('python:x.name + b'),
+                         {('x',), ('name',), ('b',)})
+        self.assertEqual(deps('python:[i for i in b]'), {('b',)})
+        self.assertIsNone(deps('python:path("x/y")'))
+        self.assertEqual(deps('not:exists:x/y'), {('x', 'y')})
+        self.assertEqual(deps('defer:b'), {('b',)})
+        self.assertEqual(deps('lazy:b'), {('b',)})
+        self.assertEqual(deps('if: x, b, python:B'),
+                         {('x',), ('b',), ('B',)})
+        self.assertEqual(deps('or: x, y | python:B'),
+                         {('x',), ('y',), ('B',)})
+
+    def test_dependencies_namespace(self):
+        from ..expressions import PathExpr
+
+        @implementer(ITALESFunctionNamespace)
+        class Namespace:
+            def __init__(self, context):
+                self.context = context
+
+            def setEngine(self, engine):
+                pass
+
+        engine = Engine.__class__()
+        engine.registerFunctionNamespace('ns', Namespace)
+        expr = PathExpr('path', 'x/y/ns:upper/z', engine)
+        self.assertEqual(expr.dependencies(), {('x', 'y')})
+
+    def test_dependencyKey(self):
+        from ..tales import UNDEFINED
+        context = self.engine.getContext({'a': {'b': 1}, 'c': 'text'})
+        key = context.dependencyKey('string:${a/b} $c ${d|c}')
+        self.assertEqual(key, ((('a', 'b'), 1), (('c',), 'text'),
+                               (('d',), UNDEFINED)))
+        context.vars['a']['b'] = 2
+        self.assertEqual(context.dependencyKey('a/b'), ((('a', 'b'), 2),))
+        # Unknown dependencies give no key.
+        self.assertIsNone(context.dependencyKey('python:path("a")'))
+
+    def test_dependencyKey_unhashable(self):
+        a = {'b': [1]}
+        context = self.engine.getContext({'a': a})
+        key = context.dependencyKey('a')
+        self.assertEqual(hash(key), hash(context.dependencyKey('a')))
+        self.assertEqual(context.dependencyKey('a'), key)
+        self.assertEqual({key: 'cached'}[context.dependencyKey('a')],
+                         'cached')
+        # Unhashable values are compared by identity.
+        a['b'].append(2)
+        self.assertEqual(context.dependencyKey('a'), key)
+        self.assertEqual(context.dependencyKey('a/b'),
+                         context.dependencyKey('a/b'))
+        context.setLocal('a', {'b': [1]})
+        self.assertNotEqual(context.dependencyKey('a'), key)
+        self.assertIn('identity of dict', repr(key))
+
+    def test_cached(self):
+        from ..engine import DefaultEngine
+        from ..tales import ResultCache
+        now = [0]
+        self.engine = DefaultEngine()
+        self.engine.resultCache = cache = ResultCache(maxsize=2,
+                                                      clock=lambda: now[0])
+        calls = []
+        self.context.vars['count'] = lambda: calls.append(1) or len(calls)
+
+        self._check_evals_to('cached: count', 1)
+        self._check_evals_to('cached: count', 1)
+        now[0] = 59
+        self._check_evals_to('cached: count', 1)
+        now[0] = 60
+        self._check_evals_to('cached: count', 2)
+        expr = self._check_evals_to('cached: ttl=5, key=b, python: count()',
+                                    3)
+        self.assertEqual(
+            "<CachedExpr ' ttl=5, key=b, python: count()'>", repr(expr))
+        self._check_evals_to(expr, 3)
+        self.context.vars['b'] = 'other'
+        self._check_evals_to(expr, 4)
+        self.assertEqual(cache.getStats(),
+                         {'hits': 3, 'misses': 4, 'evictions': 1,
+                          'hitRate': 3 / 7, 'size': 2})
+        # Unhashable keys bypass the cache.
+        self.context.vars['b'] = []
+        self._check_evals_to(expr, 5)
+        self._check_evals_to(expr, 6)
+        cache.clear()
+        self.assertEqual(cache.getStats()['size'], 0)
+
+    def test_cached_per_engine(self):
+        from ..engine import DefaultEngine
+        results = []
+        for value in ('one', 'two'):
+            engine = DefaultEngine()
+            context = engine.getContext(x=value)
+            results.append(context.evaluate('cached: x'))
+        self.assertEqual(results, ['one', 'two'])
+
+    def test_cached_ir(self):
+        from .. import ir
+        expr = self.engine.compile('cached: key=b, a/b')
+        self.assertEqual(expr.dependencies(), {('b',), ('a', 'b')})
+        node = ir.toIR(expr)
+        self.assertIsInstance(node, ir.Leaf)
+        self.assertIs(node.function, expr)
+        self.assertIs(ir.specialize(expr), expr)
+
+    def test_cached_errors(self):
+        self._check_raises_compiler_error('cached: ttl=x, b', 'Invalid ttl')
+        self._check_raises_compiler_error('cached: ttl=-1, b', 'Invalid ttl')
+        self._check_raises_compiler_error('cached: ttl=1', 'expects')
+        self._check_raises_compiler_error('cached: key=b', 'expects')
+        self._check_raises_compiler_error('cached: key=b, ', 'may not be')
+
+    def test_operand_errors(self):
+        self._check_raises_compiler_error('and: x,, b', 'may not be empty')
+        self._check_raises_compiler_error('or: x,', 'may not be empty')
+        self._check_raises_compiler_error('if: x', 'expects a condition')
+        self._check_raises_compiler_error('if: x, y, z, w',
+                                          'expects a condition')
+        self._check_raises_compiler_error("and: python:'x, b",
+                                          'Unclosed quote')
+
+    def test_operand_quotes(self):
+        from zope.tales.expressions import _split_operands
+
+        # Quotes only nest commas in python: operands.
+        self._check_evals_to("if: python:0, string:it's, string:no", 'no')
+        self._check_evals_to("or: string:, string:it's, path:b", "it's")
+        self._check_evals_to("and: string:(, python:'a,b'", 'a,b')
+        self.assertEqual(_split_operands("x, not: python:f(1, ','), y",
+                                         self.engine),
+                         ['x', "not: python:f(1, ',')", 'y'])
+        expr = self.engine.compile("cached: key=string:'(, path:b")
+        self.assertEqual(expr._key(self.context), "'(")
+
+    def test_operand_string_commas(self):
+        # A comma following string: text may be part of it.
+        self._check_raises_compiler_error(
+            'or: b, string:Dear customer, welcome', 'Ambiguous comma')
+        self._check_raises_compiler_error(
+            'if: b, string:yes, nothing', 'Ambiguous comma')
+        self._check_raises_compiler_error(
+            'and: not:string:x, unknown:y', 'Ambiguous comma')
+        self._check_raises_compiler_error(
+            'cached: key=string:x, b', 'Ambiguous comma')
+        self._check_evals_to('if: b, string:yes, path:b', 'yes')
+        self._check_evals_to('if: python:0, string:yes, string:no', 'no')
+        self._check_evals_to(
+            'or: python:0, python:"Dear customer, welcome"',
+            'Dear customer, welcome')
+        expr = self.engine.compile('cached: key=string:x, ttl=5, b')
+        self.assertEqual(expr._ttl, 5)
+
     def test_bad_initial_name_subexpr(self):
         self._check_subexpr_raises_compiler_error(
             '123',
@@ -409,6 +723,47 @@ class TestParsedExpressions(ExpressionTestBase):
             eval("None")
         self.assertIsNotNone(eval("x"))  # variable before builtin
 
+    def test_adaptive_alternatives(self):
+        from ..expressions import PathExpr
+        from ..tales import ExpressionEngine
+
+        class AdaptivePathExpr(PathExpr):
+            ADAPTIVE = True
+
+        engine = ExpressionEngine()
+        for pt in AdaptivePathExpr._default_type_names:
+            engine.registerType(pt, AdaptivePathExpr)
+        engine.registerType('string', Engine.getTypes()['string'])
+
+        self.assertIsNone(self.engine.compile('a | b').getStats())
+        expr = engine.compile('request/form/x | missing/x | b | string:no')
+        self.context.vars['request'] = {'form': {}}
+        for i in range(3):
+            self.assertEqual(expr(self.context), 'boot')
+        stats = expr.getStats()
+        self.assertEqual(stats['successes'], [0, 0, 3, 0])
+        self.assertEqual(stats['likely'], 2)
+        # The first two alternatives were skipped after the first time.
+        self.assertEqual(stats['skipped'], 4)
+
+        # The first alternative that succeeds still wins.
+        self.context.vars['request'] = {'form': {'x': 'form'}}
+        self.assertEqual(expr(self.context), 'form')
+        self.context.vars['request'] = Data(form=Data(x='attr'))
+        self.assertEqual(expr(self.context), 'attr')
+        self.assertEqual(expr.getStats()['successes'], [2, 0, 3, 0])
+
+        del self.context.vars['b']
+        self.context.vars['request'] = {}
+        self.assertEqual(expr(self.context), 'no')
+        exists = engine.compile('exists:missing | b')
+        self.assertEqual(exists(self.context), 0)
+        self.context.vars['b'] = 1
+        self.assertEqual(exists(self.context), 1)
+        self.assertEqual(exists(self.context), 1)
+        self.assertEqual(exists.getStats(),
+                         {'successes': [0, 2], 'likely': 1, 'skipped': 1})
+
 
 class FunctionTests(ExpressionTestBase):
 
@@ -548,3 +903,104 @@ class TestSimpleModuleImporter(unittest.TestCase):
     def test_no_such_submodule_package(self):
         with self.assertRaises(ModuleNotFoundError):
             self._makeOne()['zope.tales.tests.submodule']
+
+    def test_cached(self):
+        imp = self._makeOne()
+        calls = []
+
+        def _get_toplevel_module(module):
+            calls.append(module)
+            return __import__(module)
+        imp._get_toplevel_module = _get_toplevel_module
+        import os.path
+        self.assertIs(os.path, imp['os.path'])
+        self.assertIs(os.path, imp['os.path'])
+        self.assertEqual(calls, ['os.path'])
+
+    def test_allowed(self):
+        from zope.tales.expressions import SimpleModuleImporter
+        imp = SimpleModuleImporter(allowed=['os.path'])
+        import os.path
+        self.assertIs(os.path, imp._cache['os.path'])
+        self.assertIs(os.path, imp['os.path'])
+        with self.assertRaisesRegex(ModuleNotFoundError, 'not allowed'):
+            imp['os']
+
+    def test_lazy(self):
+        from zope.tales.expressions import LazyModule
+        from zope.tales.expressions import SimpleModuleImporter
+
+        class Importer(SimpleModuleImporter):
+            def _resolve(self, module):
+                calls.append(module)
+                return SimpleModuleImporter._resolve(self, module)
+
+        calls = []
+        imp = Importer(lazy=True)
+        lazy = imp['os.path']
+        self.assertIsInstance(lazy, LazyModule)
+        self.assertEqual(repr(lazy), '<LazyModule os.path>')
+        self.assertEqual(calls, [])
+        import os.path
+        self.assertIs(lazy.join, os.path.join)
+        self.assertIs(lazy.sep, os.path.sep)
+        self.assertEqual(calls, ['os.path'])
+        # Once resolved, the module itself is returned
+        self.assertIs(imp['os.path'], os.path)
+
+    def test_lazy_with_security_hook(self):
+        import sys
+
+        from zope.tales.expressions import SimpleModuleImporter
+
+        class Denied(Exception):
+            pass
+
+        class Importer(SimpleModuleImporter):
+            def _get_toplevel_module(self, module):
+                raise Denied(module)
+
+        imp = Importer(lazy=True)
+        self.addCleanup(sys.modules.pop, 'colorsys', None)
+        sys.modules.pop('colorsys', None)
+        # The hook decides right away, without finding the module.
+        with self.assertRaises(Denied):
+            imp['colorsys']
+        self.assertNotIn('colorsys', sys.modules)
+        context = Engine.getContext(modules=imp)
+        with self.assertRaises(Denied):
+            context.evaluate('exists:modules/colorsys')
+
+    def test_lazy_in_path_expression(self):
+        from zope.tales.expressions import SimpleModuleImporter
+        from zope.tales.tales import Context
+        context = Context(Engine, {})
+        context.setLocal('modules', SimpleModuleImporter(lazy=True))
+        import os.path
+        self.assertEqual(context.evaluate('modules/os.path/sep'), os.path.sep)
+        self.assertEqual(context.evaluate('python:modules["os"].sep'),
+                         os.sep)
+
+    def test_lazy_not_imported_by_path(self):
+        import sys
+
+        from zope.tales.expressions import LazyModule
+        from zope.tales.expressions import SimpleModuleImporter
+        from zope.tales.tales import Context
+        context = Context(Engine, {})
+        context.setLocal('modules', SimpleModuleImporter(lazy=True))
+        self.addCleanup(sys.modules.pop, 'colorsys', None)
+        sys.modules.pop('colorsys', None)
+        self.assertIsInstance(context.evaluate('modules/colorsys'),
+                              LazyModule)
+        self.assertNotIn('colorsys', sys.modules)
+
+    def test_lazy_missing_module(self):
+        from zope.tales.expressions import SimpleModuleImporter
+        from zope.tales.tales import Context
+        context = Context(Engine, {})
+        context.setLocal('modules', SimpleModuleImporter(lazy=True))
+        with self.assertRaises(ModuleNotFoundError):
+            context.evaluate('exists:modules/no_such_module')
+        with self.assertRaises(ModuleNotFoundError):
+            context.evaluate('modules/no_such_package.module')
@@ -0,0 +1,109 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Tests of the intermediate representation of expressions.
+"""
+import unittest
+
+from zope.tales import ir
+from zope.tales.engine import Engine
+from zope.tales.expressions import PathExpr
+
+
+class Data:
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class TestOptimize(unittest.TestCase):
+
+    def setUp(self):
+        self.context = Engine.getContext(
+            a=Data(b='ab', f=lambda: 'called'), x='x', zero=0)
+
+    def _check(self, text, explained=None):
+        expr = Engine.compile(text)
+        optimized = Engine.optimize(expr)
+        self.assertEqual(optimized(self.context), expr(self.context))
+        if explained is not None:
+            self.assertEqual(optimized.explain(), explained)
+        return optimized
+
+    def test_same_results(self):
+        for text in ('a/b', 'a/f', 'nocall:a/f', 'exists:a/c | x',
+                     'exists:nothere', 'missing | a/b', 'missing | x/y | x',
+                     'missing | string:$x', 'string:$x ${a/b}!',
+                     'and: x, zero, a/b', 'or: zero, x', 'if: zero, x',
+                     'if: x, a/b, zero', 'not:not:x', 'not:zero',
+                     'python: x * 2'):
+            self._check(text)
+        for text in ('defer:x', 'lazy:x'):
+            optimized = Engine.optimize(text)
+            self.assertEqual(optimized(self.context)(), 'x')
+
+    def test_constant_folding(self):
+        self._check('string:abc', "Const 'abc'")
+        self._check('string:a$$b', "Const 'a$b'")
+        self._check('not:string:', 'Const 1')
+        self._check('and: string:x, path:x',
+                    'Alternatives call\n  Leaf path x')
+        self._check('or: string:, not:string:, path:x', 'Const 1')
+        self._check('if: string:x, path:a/b, x',
+                    'Alternatives call\n  Leaf path a/b')
+        self._check('if: string:, path:x', 'Const None')
+        self._check('string:${x}', 'Concat\n  Alternatives call\n'
+                    '    Leaf path x')
+
+    def test_alternatives(self):
+        self._check('missing | missing | x',
+                    'Alternatives call\n  Leaf path missing\n'
+                    '  Leaf path x')
+        self._check('exists:string:x', 'Const 1')
+        self._check('missing | string:x',
+                    "Alternatives call hybrid\n  Leaf path missing\n"
+                    "  Const 'x'")
+
+    def test_not(self):
+        self._check('not:not:x',
+                    'Truth\n  Alternatives call\n    Leaf path x')
+        self._check('not:not:not:x',
+                    'Not\n  Alternatives call\n    Leaf path x')
+        self._check('not:defer:x', 'Const 0')
+        self._check('not:not:lazy:x', 'Const 1')
+        self._check('and: defer:x, x', 'Alternatives call\n  Leaf path x')
+
+    def test_opaque(self):
+        optimized = self._check('python: x')
+        self.assertIsInstance(optimized.node, ir.Leaf)
+
+        class MyPathExpr(PathExpr):
+            def __call__(self, econtext):
+                return 'mine'
+        node = ir.toIR(MyPathExpr('path', 'x', Engine))
+        self.assertIsInstance(node, ir.Leaf)
+
+    def test_pass_manager(self):
+        def upper(node):
+            if isinstance(node, ir.Const) and isinstance(node.value, str):
+                return ir.Const(node.value.upper())
+            return node
+        passes = ir.PassManager()
+        passes.addPass(upper)
+        optimized = Engine.optimize('string:abc', passes)
+        self.assertEqual(optimized(self.context), 'ABC')
+        optimized = Engine.optimize('string:abc', ir.PassManager(()))
+        self.assertEqual(optimized.explain(),
+                         "Concat\n  Const 'abc'")
+        self.assertEqual(repr(optimized),
+                         "<OptimizedExpression <StringExpr 'abc'>>")
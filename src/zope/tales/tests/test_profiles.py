@@ -0,0 +1,125 @@
+##############################################################################
+#
+# Copyright (c) 2001, 2002 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Tests of expression profiles.
+"""
+import io
+import json
+import tempfile
+import unittest
+from contextlib import redirect_stderr
+
+from zope.tales import profiles
+from zope.tales.engine import DefaultEngine
+from zope.tales.expressions import TraverserRegistry
+
+
+class Data:
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+class TestProfiles(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.dirname = tmpdir.name
+
+    def _makeEngine(self, traverser):
+        from zope.tales.expressions import PathExpr
+        from zope.tales.tales import ExpressionEngine
+
+        class MyPathExpr(PathExpr):
+            def __init__(self, name, expr, engine):
+                PathExpr.__init__(self, name, expr, engine, traverser)
+
+        engine = ExpressionEngine()
+        for pt in PathExpr._default_type_names:
+            engine.registerType(pt, MyPathExpr)
+        engine.compileCacheSize = None
+        engine.tierThreshold = 2
+        return engine
+
+    def _run(self, engine, counts):
+        context = engine.getContext(a=Data(b='ab'), d={'e': 1})
+        for text, count in counts.items():
+            for i in range(count):
+                context.evaluate(text)
+
+    def test_export_and_load(self):
+        traverser = TraverserRegistry()
+        engine = self._makeEngine(traverser)
+        self._run(engine, {'a/b': 3, 'd/e': 1})
+        filename = self.dirname + '/profile.json'
+        profiles.exportProfile(engine, filename, traverser)
+        profile = profiles.readProfile(filename)
+        self.assertEqual(profile['expressions'], {'a/b': 3, 'd/e': 1})
+        self.assertEqual(profile['types'], [
+            'builtins:dict', '%s:Data' % __name__])
+
+        traverser = TraverserRegistry()
+        engine = self._makeEngine(traverser)
+        self.assertEqual(profiles.loadProfile(engine, filename,
+                                              traverser=traverser), 1)
+        self.assertEqual(engine.compile('a/b').tier, 1)
+        self.assertEqual(engine.getTierStats(),
+                         {'expressions': 1, 'promoted': 1})
+        self.assertEqual(set(traverser.observedTypes()), {dict, Data})
+
+        engine = self._makeEngine(traverser)
+        self.assertEqual(profiles.loadProfile(engine, filename, minimum=1,
+                                              traverser=traverser), 2)
+
+    def test_load_not_a_profile(self):
+        filename = self.dirname + '/profile.json'
+        with open(filename, 'w') as f:
+            json.dump({'format': 'other'}, f)
+        with self.assertRaisesRegex(ValueError, 'not an expression profile'):
+            profiles.loadProfile(self._makeEngine(None), filename)
+
+    def test_load_skips_errors_and_unknown_types(self):
+        filename = self.dirname + '/profile.json'
+        with open(filename, 'w') as f:
+            json.dump({'format': profiles.FORMAT,
+                       'version': profiles.VERSION,
+                       'expressions': {'unknown:x': 5, 'a/b': 5},
+                       'types': ['no.such.module:Type', 'builtins:len']}, f)
+        traverser = TraverserRegistry()
+        self.assertEqual(profiles.loadProfile(self._makeEngine(traverser),
+                                              filename, minimum=5,
+                                              traverser=traverser), 1)
+        self.assertEqual(traverser.observedTypes(), [])
+        # The expressions compiled must be kept.
+        with self.assertRaisesRegex(ValueError, 'compileCacheSize'):
+            profiles.loadProfile(DefaultEngine(), filename)
+
+    def test_merge_cli(self):
+        names = []
+        for i, counts in enumerate(({'a/b': 3}, {'a/b': 1, 'd/e': 2})):
+            traverser = TraverserRegistry()
+            engine = self._makeEngine(traverser)
+            self._run(engine, counts)
+            names.append('{}/{}.json'.format(self.dirname, i))
+            profiles.exportProfile(engine, names[-1], traverser)
+        output = self.dirname + '/merged.json'
+        self.assertEqual(profiles.main(['-o', output] + names), 0)
+        merged = profiles.readProfile(output)
+        self.assertEqual(merged['expressions'], {'a/b': 4, 'd/e': 2})
+        self.assertEqual(len(merged['types']), 2)
+
+        stderr = io.StringIO()
+        with self.assertRaises(SystemExit), redirect_stderr(stderr):
+            profiles.main(['-o', output, self.dirname + '/missing.json'])
+        self.assertIn('No such file', stderr.getvalue())
@@ -13,6 +13,7 @@
 ##############################################################################
 """TALES Tests
 """
+import gc
 import sys
 import unittest
 from doctest import DocTestSuite
@@ -188,6 +189,437 @@ class TestExpressionEngine(unittest.TestCase):
         self.assertEqual(ctx.contexts['b'], 2)
         self.assertEqual(ctx.contexts['c'], 1)
 
+    def test_pooled_context(self):
+        context = self.engine.getPooledContext(a=1)
+        self.assertEqual(context.vars['a'], 1)
+        context.beginScope()
+        context.setLocal('b', 2)
+        context.repeat_vars['it'] = None
+        context.setPosition((1, 2))
+        self.engine.releaseContext(context)
+
+        reused = self.engine.getPooledContext({'c': 3}, d=4)
+        self.assertIs(reused, context)
+        self.assertEqual(sorted(reused.vars),
+                         ['c', 'd', 'default', 'loop', 'nothing', 'repeat'])
+        self.assertIs(reused.contexts['repeat'], reused.repeat_vars)
+        self.assertEqual(reused.repeat_vars, {})
+        self.assertEqual(reused._vars_stack, [reused.vars])
+        self.assertEqual(reused._scope_stack, [])
+        self.assertEqual(reused.position, (None, None))
+        # The pool is empty again
+        self.assertIsNot(self.engine.getPooledContext(), reused)
+
+    def test_pooled_context_stale_references(self):
+        from zope.tales.engine import DefaultEngine
+        engine = DefaultEngine()
+        context = engine.getPooledContext(x='first')
+        context.setLocal('thing', context.evaluate('defer: x'))
+        thing = context.getValue('thing')
+        context.beginScope()
+        iterator = context.setRepeat('item', 'python: [1, 2]')
+        self.assertEqual(thing(), 'first')
+        self.assertTrue(next(iterator))
+        engine.releaseContext(context)
+
+        reused = engine.getPooledContext(x='second')
+        self.assertIs(reused, context)
+        with self.assertRaisesRegex(tales.TALESError, 'reset'):
+            thing()
+        with self.assertRaisesRegex(tales.TALESError, 'reset'):
+            next(iterator)
+        self.assertNotIn('item', reused.vars)
+        self.assertEqual(reused.evaluate('defer: x')(), 'second')
+
+    def test_pooled_context_limit(self):
+        self.engine.contextPoolSize = 1
+        first = self.engine.getPooledContext()
+        second = self.engine.getPooledContext()
+        self.engine.releaseContext(first)
+        self.engine.releaseContext(second)
+        self.assertEqual(self.engine._pool.contexts, [first])
+
+    def test_pooled_context_per_thread(self):
+        import threading
+        context = self.engine.getPooledContext()
+        self.engine.releaseContext(context)
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(self.engine.getPooledContext()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], context)
+        self.assertIs(self.engine.getPooledContext(), context)
+
+    def test_compile_cache(self):
+        self.engine.registerType('simple', SimpleExpr)
+        # Disabled by default
+        self.assertIsNot(self.engine.compile('simple:x'),
+                         self.engine.compile('simple:x'))
+        self.assertEqual(self.engine._cache, {})
+        self.engine.compileCacheSize = 10
+        compiled = self.engine.compile('simple:x')
+        self.assertIs(compiled, self.engine.compile('simple:x'))
+        # Changing the configuration invalidates the cache
+        self.engine.registerFunctionNamespace('ns', None)
+        self.assertIsNot(compiled, self.engine.compile('simple:x'))
+
+    def test_compile_cache_size(self):
+        self.engine.registerType('simple', SimpleExpr)
+        self.engine.compileCacheSize = 2
+        self.engine.tierThreshold = 10
+        first = self.engine.compile('simple:x')
+        self.assertIs(self.engine.compile('simple:x'), first)
+        self.engine.compile('simple:0')
+        # Hits only read the cache: the oldest entry is evicted first.
+        self.assertIs(self.engine.compile('simple:x'), first)
+        self.assertEqual(list(self.engine._cache), ['simple:x', 'simple:0'])
+        for i in range(100):
+            self.engine.compile('simple:%d' % i)
+        self.assertEqual(list(self.engine._cache),
+                         ['simple:98', 'simple:99'])
+        self.assertEqual(list(self.engine._tiered),
+                         ['simple:98', 'simple:99'])
+        self.assertIsNot(self.engine.compile('simple:x'), first)
+        self.engine.compileCacheSize = 0
+        self.assertIsNot(self.engine.compile('simple:y'),
+                         self.engine.compile('simple:y'))
+        self.assertEqual(len(self.engine._cache), 0)
+
+    def test_warmup(self):
+        from zope.tales.engine import DefaultEngine
+        engine = DefaultEngine()
+        with self.assertRaisesRegex(ValueError, 'compileCacheSize'):
+            engine.warmup(['x/title'])
+        engine.compileCacheSize = 10
+        self.assertEqual(engine.warmup(['x/title', 'string:${x/title}']), 2)
+        # The path interpolated in the string is compiled as path:x/title.
+        self.assertEqual(len(engine._cache), 3)
+        segment = engine.compile('x/title')._subexprs[0].__self__
+        self.assertIs(segment._compiled_path[0][0],
+                      sys.intern(''.join(['ti', 'tle'])))
+
+    @unittest.skipUnless(hasattr(gc, 'freeze'), 'gc.freeze not available')
+    def test_warmup_freeze(self):
+        self.addCleanup(gc.unfreeze)
+        self.engine.compileCacheSize = 10
+        self.engine.warmup([], freeze=True)
+        self.assertGreater(gc.get_freeze_count(), 0)
+
+
+class TestMemory(unittest.TestCase):
+
+    def _makeEngine(self):
+        from zope.tales.engine import DefaultEngine
+        engine = DefaultEngine()
+        engine.compileCacheSize = None
+        return engine
+
+    def test_shared_segments(self):
+        engine = self._makeEngine()
+        first = engine.compile('x/title/text')._subexprs[0].__self__
+        second = engine.compile('y | x/title/text')._subexprs[1].__self__
+        self.assertIsNot(first, second)
+        self.assertIs(first._compiled_path, second._compiled_path)
+        self.assertIs(first._compiled_path[0], second._compiled_path[0])
+        self.assertIsInstance(engine.compile('x')._subexprs, tuple)
+
+    def test_shared_segments_per_engine(self):
+        engine = self._makeEngine()
+        first = engine.compile('x/title')._subexprs[0].__self__
+        other = self._makeEngine().compile('x/title')._subexprs[0].__self__
+        self.assertIsNot(first._compiled_path, other._compiled_path)
+        # The table is dropped with the cache, and bounded by its size.
+        engine.registerFunctionNamespace('ns', None)
+        self.assertEqual(engine._sharedTuples, {})
+        engine.compileCacheSize = 2
+        for i in range(20):
+            engine.compile('x/a%d' % i)
+        self.assertLessEqual(len(engine._sharedTuples), 8)
+
+    def test_drop_source_text(self):
+        engine = self._makeEngine()
+        engine.dropSourceText = True
+        expr = engine.compile('string:${x/title} $y')
+        self.assertNotIn('_s', expr.__dict__)
+        self.assertEqual(repr(expr), "<StringExpr '${x/title} $y'>")
+        self.assertEqual(repr(expr._vars[0]), "<PathExpr path:'x/title'>")
+        context = engine.getContext(x={'title': 'T'}, y='Y')
+        self.assertEqual(context.evaluate(expr), 'T Y')
+
+        engine = self._makeEngine()
+        engine.dropSourceText = True
+        engine.keepDroppedSource = False
+        self.assertEqual(repr(engine.compile('not:x')), "<NotExpr ''>")
+        # Expressions not supporting it keep their text.
+        self.assertEqual(engine.compile('cached:x')._s, 'x')
+
+    def test_memoryReport(self):
+        engine = self._makeEngine()
+        engine.compile('string:${x/title} ${x/title}')
+        engine.compile('python: x')
+        report = engine.memoryReport()
+        self.assertEqual(report['expressions'], 3)
+        self.assertEqual(report['objects'],
+                         {'StringExpr': 1, 'PathExpr': 1, 'SubPathExpr': 1,
+                          'PythonExpr': 1})
+        self.assertGreater(report['bytes'], report['sourceBytes'])
+        engine = self._makeEngine()
+        engine.dropSourceText = True
+        engine.keepDroppedSource = False
+        engine.compile('string:${x/title} ${x/title}')
+        engine.compile('python: x')
+        smaller = engine.memoryReport()
+        self.assertLess(smaller['sourceBytes'], report['sourceBytes'])
+        self.assertLess(smaller['bytes'], report['bytes'])
+
+
+class TestTiered(unittest.TestCase):
+
+    def setUp(self):
+        from zope.tales.engine import DefaultEngine
+        self.engine = DefaultEngine()
+        self.engine.compileCacheSize = None
+        self.engine.tierThreshold = 3
+        self.promoted = []
+        self.engine.onPromotion = self.promoted.append
+        self.context = self.engine.getContext(a={'b': 'ab'}, x=2)
+
+    def test_promotion(self):
+        engine = self.engine
+        for text, result in (('a/b', 'ab'), ('string:${a/b}!', 'ab!'),
+                             ('python: x * 2', 4),
+                             ('python: path("a/b")', 'ab'),
+                             ('python: len(a) + y', NameError)):
+            expr = engine.compile(text)
+            self.assertIsInstance(expr, tales.TieredExpression)
+            self.assertIs(engine.compile(text), expr)
+            for i in range(5):
+                if result is NameError:
+                    self.assertRaises(NameError, self.context.evaluate, expr)
+                else:
+                    self.assertEqual(self.context.evaluate(expr), result)
+            self.assertEqual((expr.count, expr.tier), (5, 1))
+            self.assertIsNot(expr._call, expr.expression)
+        self.assertEqual(len(self.promoted), 5)
+        self.assertEqual(engine.getTierStats(),
+                         {'expressions': 5, 'promoted': 5})
+        self.assertEqual(repr(engine.compile('a/b')),
+                         "<TieredExpression <PathExpr standard:'a/b'> "
+                         "tier 1>")
+
+    def test_python_attributes_not_bound(self):
+        expr = self.engine.compile('python: a.get("b").upper() + str(x)')
+        expr.promote()
+
+        def fallback(econtext, builtins):
+            raise AssertionError('fell back')
+        expr.expression._bind_used_names = fallback
+        self.assertEqual(self.context.evaluate(expr), 'AB2')
+
+    def test_subexpressions_not_wrapped(self):
+        from zope.tales.expressions import NotExpr
+        expr = self.engine.compile('not:not:a/b')
+        self.assertIs(type(expr.expression), NotExpr)
+        # Attributes of the wrapped expression are available.
+        self.assertEqual(expr._s, 'not:a/b')
+        self.assertEqual(expr.dependencies(), {('a', 'b')})
+
+    def test_opaque(self):
+        from zope.tales.expressions import PathExpr
+
+        class MyPathExpr(PathExpr):
+            def __call__(self, econtext):
+                return 'mine'
+        self.engine.registerType('mine', MyPathExpr)
+        expr = self.engine.compile('mine:a')
+        expr.promote()
+        self.assertIs(expr._call, expr.expression)
+        self.assertEqual(self.engine.getTierStats(),
+                         {'expressions': 1, 'promoted': 1})
+
+    def test_copy(self):
+        import copy
+        expr = self.engine.compile('a/b')
+        clone = copy.copy(expr)
+        self.assertIs(clone.expression, expr.expression)
+        self.assertEqual(self.context.evaluate(clone), 'ab')
+        blank = tales.TieredExpression.__new__(tales.TieredExpression)
+        self.assertRaises(AttributeError, getattr, blank, 'expression')
+        self.assertRaises(AttributeError, getattr, blank, '_s')
+        self.assertFalse(hasattr(expr, '__length_hint__'))
+
+
+class TestCompileGroup(unittest.TestCase):
+
+    texts = ['string:${x/title} (${x/title})', 'x/title',
+             'not: x/title', 'python: x["title"]', 'string:${x/title}!']
+
+    def setUp(self):
+        from zope.tales.engine import DefaultEngine
+        self.engine = DefaultEngine()
+        self.calls = []
+
+        def title():
+            self.calls.append(1)
+            return 'Title'
+        self.context = self.engine.getContext(x={'title': title})
+
+    def test_shared(self):
+        group = self.engine.compileGroup(self.texts)
+        self.assertEqual(len(group), 5)
+        self.assertEqual([self.context.evaluate(expr) for expr in group],
+                         ['Title (Title)', 'Title', 0,
+                          group[3](self.context), 'Title!'])
+        first = group[0]._segments[1]
+        self.assertIs(group[4]._segments[1], first)
+        self.assertIs(group[2]._c, group[1])
+        self.assertEqual(group.getStats(), {'requested': 9, 'unique': 6})
+
+    def test_share_results(self):
+        from zope.tales.tales import SharedExpression
+        group = self.engine.compileGroup(self.texts, shareResults=True)
+        shared = group[0]._segments[1]
+        self.assertIsInstance(shared, SharedExpression)
+        self.assertIs(group[4]._segments[1], shared)
+        # The engine's own cache is left alone.
+        self.assertNotIn('not: x/title', self.engine._cache)
+
+        results = [self.context.evaluate(expr) for expr in group]
+        self.assertEqual(len(self.calls), 5)
+        self.context.setTracking()
+        self.assertEqual([self.context.evaluate(expr) for expr in group],
+                         results)
+        # Only path:x/title and x/title are evaluated.
+        self.assertEqual(len(self.calls), 7)
+        self.context.setLocal('x', {'title': 'New'})
+        self.assertEqual(self.context.evaluate(group[4]), 'New!')
+
+    def test_copy_shared(self):
+        import copy
+
+        from zope.tales.tales import SharedExpression
+        group = self.engine.compileGroup(self.texts, shareResults=True)
+        shared = group[0]._segments[1]
+        clone = copy.copy(shared)
+        self.assertIs(clone.expression, shared.expression)
+        self.assertEqual(self.context.evaluate(clone), 'Title')
+        blank = SharedExpression.__new__(SharedExpression)
+        self.assertRaises(AttributeError, getattr, blank, 'expression')
+        self.assertRaises(AttributeError, getattr, blank, '_s')
+
+
+class TestConcurrentCompilation(unittest.TestCase):
+
+    def test_single_flight(self):
+        import threading
+        import time
+        compiled = []
+
+        class SlowExpr(SimpleExpr):
+            def __init__(self, name, expr, engine):
+                compiled.append(expr)
+                time.sleep(0.01)
+                SimpleExpr.__init__(self, name, expr, engine)
+
+        engine = tales.ExpressionEngine()
+        engine.compileCacheSize = None
+        engine.registerType('slow', SlowExpr)
+        expressions = ['slow:%d' % i for i in range(10)]
+        barrier = threading.Barrier(8)
+        results = []
+
+        def compile_all():
+            barrier.wait()
+            results.append([engine.compile(e) for e in expressions])
+
+        threads = [threading.Thread(target=compile_all) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(compiled), sorted(e[5:] for e in expressions))
+        self.assertEqual(len(results), 8)
+        for result in results:
+            self.assertEqual(result, results[0])
+        self.assertEqual(engine._compiling, {})
+
+    def test_failed_compilation_is_not_shared(self):
+        engine = tales.ExpressionEngine()
+        with self.assertRaises(tales.CompilerError):
+            engine.compile('nope:x')
+        self.assertEqual(engine._compiling, {})
+        self.assertEqual(engine._cache, {})
+
+    def test_registration_copies(self):
+        engine = tales.ExpressionEngine()
+        types = engine.getTypes()
+        engine.registerType('simple', SimpleExpr)
+        self.assertEqual(types, {})
+        self.assertEqual(engine.getTypes(), {'simple': SimpleExpr})
+        engine.registerBaseName('abc', 1)
+        self.assertEqual(engine.getBaseNames(), {'abc': 1})
+
+
+class TestBundle(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.filename = tmpdir.name + '/expressions.bundle'
+
+    def _makeEngine(self):
+        from zope.tales.engine import DefaultEngine
+        engine = DefaultEngine()
+        self.addCleanup(setattr, engine, '_bundle', None)
+        return engine
+
+    def test_dump_and_load(self):
+        engine = self._makeEngine()
+        count = engine.dumpBundle(
+            self.filename,
+            ['python: a + 1', 'x | python: a * 2', 'not:python:a', 'x/y'])
+        self.assertEqual(count, 3)
+
+        engine = self._makeEngine()
+        self.assertTrue(engine.loadBundle(self.filename))
+
+        def fail(text, filename):
+            raise AssertionError('%s was not taken from the bundle' % text)
+
+        self.assertEqual(engine.compilePythonCode('( a + 1)', fail).co_names,
+                         ('a',))
+        context = engine.getContext(a=2)
+        self.assertEqual(context.evaluate('python: a + 1'), 3)
+        self.assertEqual(context.evaluate('x | python: a * 2'), 4)
+        # Expressions missing from the bundle are compiled as usual
+        self.assertEqual(context.evaluate('python: a - 1'), 1)
+
+    def test_load_other_configuration(self):
+        engine = self._makeEngine()
+        engine.dumpBundle(self.filename, ['python: 1'])
+        engine = self._makeEngine()
+        engine.registerType('simple', SimpleExpr)
+        self.assertFalse(engine.loadBundle(self.filename))
+        self.assertIsNone(engine._bundle)
+
+    def test_configuration_change_drops_bundle(self):
+        engine = self._makeEngine()
+        engine.dumpBundle(self.filename, ['python: 1'])
+        self.assertTrue(engine.loadBundle(self.filename))
+        engine.registerFunctionNamespace('ns', None)
+        self.assertIsNotNone(engine._bundle)
+        engine.registerType('simple', SimpleExpr)
+        self.assertIsNone(engine._bundle)
+
+    def test_load_not_a_bundle(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'not a bundle')
+        with self.assertRaisesRegex(ValueError, 'not an expression bundle'):
+            self._makeEngine().loadBundle(self.filename)
+
 
 class TestContext(unittest.TestCase):
 
@@ -251,6 +683,25 @@ class TestContext(unittest.TestCase):
         self.context.vars['it'] = 'text'
         self.assertEqual('text', self.context.evaluateText("it"))
 
+    def test_evaluateInto(self):
+        self.context.vars['it'] = 'text'
+        buf = []
+        self.assertIsNone(
+            self.context.evaluateInto('string:a ${it} b', buf))
+        self.assertEqual(buf, ['a ', 'text', ' b'])
+
+        written = []
+        self.assertIsNone(self.context.evaluateInto('it', written.append))
+        self.assertEqual(written, ['text'])
+
+    def test_evaluateInto_none_and_default(self):
+        self.context.vars['it'] = None
+        buf = []
+        self.assertIsNone(self.context.evaluateInto('it', buf))
+        self.assertIs(self.context.evaluateInto('default', buf),
+                      self.context.getDefault())
+        self.assertEqual(buf, [])
+
     def test_traceback_supplement(self):
         def raises(self):
             raise Exception()
@@ -287,10 +738,304 @@ class TestContext(unittest.TestCase):
         # And we didn't change the data in the context
         self.assertIn('modules', self.context.contexts)
 
+    def test_render_leaves_no_cyclic_garbage(self):
+        if gc.isenabled():
+            gc.disable()
+            self.addCleanup(gc.enable)
+        gc.collect()
+        context = self.engine.getContext(items=[1, 2, 3])
+        context.beginScope()
+        context.setGlobal('deferred', context.evaluate('defer: items'))
+        context.setLocal('lazy', context.evaluate('lazy: items'))
+        it = context.setRepeat('item', 'items')
+        while next(it):
+            context.evaluate('string:${deferred} ${lazy} ${repeat/item/index}')
+        context.endScope()
+        del context, it
+        self.assertEqual(gc.collect(), 0)
+
+    def test_unstored_objects_keep_context(self):
+        it = tales.Iterator('i', [1], self.engine.getContext())
+        self.assertTrue(next(it))
+        wrapper = self.engine.getContext(a=1).evaluate('defer: a')
+        self.assertEqual(wrapper(), 1)
+
+    def test_stored_objects_after_context_freed(self):
+        context = self.engine.getContext(items=[1, 2])
+        context.beginScope()
+        context.setLocal('deferred', context.evaluate('defer: items'))
+        wrapper = context.vars['deferred']
+        it = context.setRepeat('item', 'items')
+        del context
+        with self.assertRaisesRegex(tales.TALESError,
+                                    'DeferWrapper used after its context'):
+            wrapper()
+        with self.assertRaisesRegex(tales.TALESError,
+                                    'Iterator used after its context'):
+            next(it)
+
     def test_translate(self):
         self.assertIsInstance(self.context.translate(b'abc'), str)
 
 
+class TestTracking(unittest.TestCase):
+
+    def setUp(self):
+        from zope.tales.engine import DefaultEngine
+        self.calls = []
+
+        def counter():
+            self.calls.append(1)
+            return len(self.calls)
+        # Evaluations are memoized by compiled expression, so the same
+        # text must compile to the same object.
+        engine = DefaultEngine()
+        engine.compileCacheSize = None
+        self.context = engine.getContext(a=1, b=2, counter=counter)
+        self.context.setTracking()
+
+    def test_memoized_until_set(self):
+        context = self.context
+        self.assertEqual(context.evaluate('string:$a ${counter}'), '1 1')
+        self.assertEqual(context.evaluate('string:$a ${counter}'), '1 1')
+        self.assertEqual(context.evaluate('python:b + counter()'), 4)
+        context.setLocal('b', 3)
+        self.assertEqual(context.evaluate('string:$a ${counter}'), '1 1')
+        self.assertEqual(context.evaluate('python:b + counter()'), 6)
+        context.setGlobal('a', 0)
+        self.assertEqual(context.evaluate('string:$a ${counter}'), '0 4')
+        context.invalidate('counter')
+        self.assertEqual(context.evaluate('python:b + counter()'), 8)
+
+    def test_scopes(self):
+        context = self.context
+        context.beginScope()
+        context.setLocal('a', 'inner')
+        self.assertEqual(context.evaluate('a'), 'inner')
+        context.endScope()
+        self.assertEqual(context.evaluate('a'), 1)
+
+    def test_volatile(self):
+        context = self.context
+        context.evaluate('repeat/x | counter')
+        context.evaluate('repeat/x | counter')
+        context.evaluate('python:path("counter")')
+        self.assertEqual(len(self.calls), 3)
+
+    def test_deferred(self):
+        context = self.context
+        context.setLocal('d', context.evaluate('defer:string:$a'))
+        self.assertEqual(context.evaluate('d'), '1')
+        context.setLocal('a', 2)
+        self.assertEqual(context.evaluate('d'), '2')
+
+    def test_off(self):
+        context = self.context
+        context.setTracking(False)
+        context.evaluate('counter')
+        context.evaluate('counter')
+        self.assertEqual(len(self.calls), 2)
+        context.setTracking()
+        context.reset({'counter': 1})
+        self.assertIsNone(context._memo)
+
+
+class TestLoopInvariants(unittest.TestCase):
+
+    def setUp(self):
+        from zope.tales.engine import DefaultEngine
+        self.engine = DefaultEngine()
+        self.engine.compileCacheSize = None
+        self.calls = []
+
+        def url():
+            self.calls.append(1)
+            return 'http://site'
+        self.context = self.engine.getContext(
+            context={'portal_url': url}, items=['a', 'b', 'c'])
+
+    def test_isLoopInvariant(self):
+        def invariant(text, names=('item',)):
+            return tales.isLoopInvariant(self.engine.compile(text), names)
+        self.assertTrue(invariant('context/portal_url'))
+        self.assertTrue(invariant('string:${context/portal_url}/x'))
+        self.assertFalse(invariant('string:${context/portal_url}/$item'))
+        self.assertFalse(invariant('repeat/item/index'))
+        self.assertFalse(invariant('python: item.upper()'))
+        self.assertTrue(invariant('python: len(items)'))
+        self.assertFalse(invariant('python: path("item")'))
+        self.assertFalse(invariant('context/portal_url', ('context',)))
+
+    def test_evaluateInvariant(self):
+        context = self.context
+        context.beginScope()
+        it = context.setRepeat('item', 'items')
+        results = []
+        while next(it):
+            context.beginScope()
+            context.setLocal('x', 1)
+            results.append((
+                context.evaluateInvariant('context/portal_url'),
+                context.evaluateInvariant('string:$item')))
+            context.endScope()
+        self.assertEqual(results, [('http://site', 'a'),
+                                   ('http://site', 'b'),
+                                   ('http://site', 'c')])
+        self.assertEqual(len(self.calls), 1)
+        context.endScope()
+        # Rebinding a variable it reads gives a new result.
+        context.setLocal('context', {'portal_url': 'other'})
+        self.assertEqual(context.evaluateInvariant('context/portal_url'),
+                         'other')
+
+    def test_evaluateInvariant_deferred(self):
+        context = self.context
+        context.beginScope()
+        # d is bound once, but reads the loop variable.
+        context.setLocal('d', context.evaluate('defer:item'))
+        it = context.setRepeat('item', 'items')
+        results = []
+        while next(it):
+            results.append(context.evaluateInvariant('d'))
+        self.assertEqual(results, ['a', 'b', 'c'])
+        context.endScope()
+
+
+class TestBudget(unittest.TestCase):
+
+    def setUp(self):
+        from zope.tales.engine import Engine
+        self.context = Engine.getContext(a={'b': 1}, seq=range(10))
+        self.context.beginScope()
+
+    def test_steps(self):
+        context = self.context
+        context.setBudget(steps=3)
+        self.assertEqual(context.evaluate('a/b'), 1)
+        # The paths of a string expression are not counted.
+        self.assertEqual(context.evaluate('string:${a/b} ${a/b}'), '1 1')
+        self.assertEqual(context.evaluate('a/b | nothing'), 1)
+        with self.assertRaises(tales.BudgetExceeded):
+            context.evaluate('a/b')
+        context.setBudget()
+        self.assertEqual(context.evaluate('a/b'), 1)
+
+    def test_repeat(self):
+        context = self.context
+        context.setBudget(steps=10)
+        it = context.setRepeat('item', 'seq')
+        with self.assertRaises(tales.BudgetExceeded):
+            while next(it):
+                pass
+        self.assertEqual(context.vars['item'], 7)
+
+    def test_deadline(self):
+        context = self.context
+        context.setBudget(seconds=60)
+        self.assertEqual(context.evaluate('a/b'), 1)
+        context.setBudget(seconds=-1)
+        with self.assertRaisesRegex(tales.BudgetExceeded, 'deadline'):
+            context.evaluate('a/b')
+        context.reset({})
+        self.assertIsNone(context._budget)
+
+    def test_deadline_checked_periodically(self):
+        context = self.context
+        context.setBudget(seconds=60)
+        self.assertEqual(context.evaluate('a/b'), 1)
+        # The deadline passes during the evaluations; it is noticed
+        # within an interval of the clock.
+        context._budget.deadline -= 120
+        with self.assertRaisesRegex(tales.BudgetExceeded, 'deadline'):
+            for i in range(tales._Budget.CLOCK_INTERVAL):
+                context.evaluate('a/b')
+
+    def test_steps_and_deadline(self):
+        context = self.context
+        context.setBudget(seconds=60, steps=2)
+        self.assertEqual(context.evaluate('a/b'), 1)
+        self.assertEqual(context.evaluate('string:x'), 'x')
+        with self.assertRaisesRegex(tales.BudgetExceeded, 'step'):
+            context.evaluate('a/b')
+
+
+class TestTranslationCache(unittest.TestCase):
+
+    def _makeContext(self, cache):
+        calls = []
+
+        class CountingContext(tales.Context):
+            translationCache = cache
+            language = 'en'
+
+            def getLanguage(self):
+                return self.language
+
+            def translateMessage(self, msgid, domain=None, mapping=None,
+                                 default=None):
+                calls.append(msgid)
+                return '{}:{}:{}'.format(self.language, domain, msgid)
+
+            def translateMessages(self, msgids, domain=None):
+                calls.append(tuple(msgids))
+                return [self.translateMessage(msgid, domain)
+                        for msgid in msgids]
+
+        return CountingContext(tales.ExpressionEngine(), {}), calls
+
+    def test_cached(self):
+        cache = tales.TranslationCache()
+        context, calls = self._makeContext(cache)
+        self.assertEqual(context.translate('hello', 'd'), 'en:d:hello')
+        self.assertEqual(context.translate('hello', 'd'), 'en:d:hello')
+        self.assertEqual(calls, ['hello'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        context.translate('hello', 'other')
+        context.language = 'fr'
+        self.assertEqual(context.translate('hello', 'd'), 'fr:d:hello')
+        self.assertEqual(calls, ['hello'] * 3)
+
+    def test_mapping_bypasses_cache(self):
+        cache = tales.TranslationCache()
+        context, calls = self._makeContext(cache)
+        context.translate('hello', mapping={'a': 1})
+        context.translate('hello', mapping={'a': 1})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(cache), 0)
+
+        class Message(str):
+            mapping = {'a': 1}
+        context.translate(Message('hello'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru(self):
+        cache = tales.TranslationCache(maxsize=2)
+        context, calls = self._makeContext(cache)
+        for msgid in ('a', 'b', 'a', 'c', 'a', 'b'):
+            context.translate(msgid)
+        self.assertEqual(calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits), (0, 0))
+
+    def test_translateMany(self):
+        cache = tales.TranslationCache()
+        context, calls = self._makeContext(cache)
+        context.translate('a')
+        del calls[:]
+        self.assertEqual(context.translateMany(['a', 'b', 'c']),
+                         ['en:None:a', 'en:None:b', 'en:None:c'])
+        self.assertEqual(calls[0], ('b', 'c'))
+        del calls[:]
+        context.translateMany(['a', 'b', 'c'])
+        self.assertEqual(calls, [])
+
+    def test_no_cache(self):
+        context = tales.Context(tales.ExpressionEngine(), {})
+        self.assertIsNone(context.translationCache)
+        self.assertEqual(context.translateMany(['a', 'b']), ['a', 'b'])
+
+
 class Harness:
     def __init__(self, testcase):
         self._callstack = []
@@ -123,3 +123,89 @@ class TraverserTests(TestCase):
         # __getitem__)
         ob = AllTraversable()
         self.assertRaises(KeyError, simpleTraverse, ob, ['missing_attr'], None)
+
+
+class TraverserRegistryTests(TestCase):
+
+    def _makeOne(self):
+        from zope.tales.expressions import TraverserRegistry
+        return TraverserRegistry()
+
+    def test_default_like_simpleTraverse(self):
+        from zope.tales.expressions import defaultTraverser
+        for ob in AttrTraversable(), ItemTraversable(), AllTraversable():
+            self.assertEqual(defaultTraverser(ob, ['attr'], None), 'foo')
+        self.assertRaises(
+            AttributeError, defaultTraverser, AttrTraversable(), ['x'], None)
+        self.assertRaises(
+            KeyError, defaultTraverser, AllTraversable(), ['x'], None)
+
+    def test_default_dict(self):
+        from zope.tales.expressions import defaultTraverser
+        ob = {'attr': 'foo', 'items': 'bar'}
+        self.assertEqual(defaultTraverser(ob, ['attr'], None), 'foo')
+        # Attributes win over items, as with simpleTraverse
+        self.assertEqual(defaultTraverser(ob, ['items'], None), ob.items)
+        self.assertRaises(KeyError, defaultTraverser, ob, ['missing'], None)
+
+        class Dict(dict):
+            attr = 'class'
+        self.assertEqual(defaultTraverser(Dict(ob), ['attr'], None), 'class')
+
+    def test_default_sequences(self):
+        from collections import namedtuple
+
+        from zope.tales.expressions import defaultTraverser
+        ob = [{'attr': 'foo'}, ('a', 'b')]
+        self.assertEqual(defaultTraverser(ob, ['0', 'attr'], None), 'foo')
+        self.assertEqual(defaultTraverser(ob, ['1', '1'], None), 'b')
+        self.assertEqual(defaultTraverser(ob, ['count'], None), ob.count)
+        self.assertRaises(IndexError, defaultTraverser, ob, ['2'], None)
+        self.assertRaises(TypeError, defaultTraverser, ob, ['x'], None)
+        # Only canonical integers index, like in compiled paths.
+        for name in '01', '+1', '1\n', '\u0661':
+            self.assertRaises(TypeError, defaultTraverser, ob, [name], None)
+
+        Point = namedtuple('Point', 'x y')
+        point = Point(1, 2)
+        self.assertEqual(defaultTraverser(point, ['y'], None), 2)
+        self.assertEqual(defaultTraverser(point, ['0'], None), 1)
+
+    def test_register_and_lookup(self):
+        registry = self._makeOne()
+
+        def step(ob, name, econtext):
+            return (name, econtext)
+
+        self.assertIsNot(registry.lookup(ItemTraversable), step)
+        registry.register(ItemTraversable, step)
+        self.assertIs(registry.lookup(ItemTraversable), step)
+        # Subclasses use the registration of their bases
+        self.assertIs(registry.lookup(AllTraversable), step)
+        self.assertIsNot(registry.lookup(AttrTraversable), step)
+        self.assertEqual(registry(AllTraversable(), ['x'], 42), ('x', 42))
+        self.assertEqual(registry(AttrTraversable(), ['attr'], None), 'foo')
+
+    def test_path_default(self):
+        from zope.tales.engine import Engine
+        from zope.tales.expressions import PathExpr
+        from zope.tales.expressions import defaultTraverser
+        from zope.tales.expressions import simpleTraverse
+        expr = PathExpr('path', 'a/b', Engine)
+        self.assertIs(expr._subexprs[0].__self__._traverser, simpleTraverse)
+        expr = PathExpr('path', 'a/0', Engine, defaultTraverser)
+        self.assertEqual(expr(Engine.getContext(a=[1])), 1)
+
+    def test_dispatch_bounded(self):
+        registry = self._makeOne()
+        registry.dispatchCacheSize = 2
+        types = [type('T%d' % i, (AttrTraversable,), {}) for i in range(3)]
+        for t in types:
+            self.assertEqual(registry(t(), ['attr'], None), 'foo')
+        self.assertEqual(registry.observedTypes(), types[2:])
+
+    def test_register_invalidates_lookups(self):
+        registry = self._makeOne()
+        registry.lookup(AllTraversable)
+        registry.register(AllTraversable, getattr)
+        self.assertIs(registry.lookup(AllTraversable), getattr)